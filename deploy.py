@@ -10,15 +10,23 @@ def static_deploy():
     os.system("rsync -avz static/ corn.stanford.edu:%s/WWW/static" % base_dir)
     print "Successfully deployed static files into production!"
 
+def cron_deploy():
+    base_dir = update_options()
+    os.system("sed 's|BASE_DIR|%s|g' crontab | ssh corn.stanford.edu crontab -" % base_dir)
+    print "Successfully installed the crontab in production!"
+
 def code_deploy():
     base_dir = update_options()
-    os.system("rsync -avz ohms/ corn.stanford.edu:%s/ohms" % base_dir)
+    # the template cache is rebuilt in place, since cached templates are keyed by their path
+    os.system("rsync -avz --exclude .jinja_cache ohms/ corn.stanford.edu:%s/ohms" % base_dir)
+    os.system("ssh corn.stanford.edu 'cd %s/ohms && python precompile.py'" % base_dir)
     print "Successfully deployed code files into production!"
 
 if len(sys.argv) < 2:
-    print '''The command is: python deploy.py (local/prod) (code/static/both) 
+    print '''The command is: python deploy.py (local/prod) (code/static/both/cron) 
 depending on where you want to deploy the system, and whether you want to copy just 
-the Python code, the static Javascript and CSS files, or both.'''
+the Python code, the static Javascript and CSS files, or both. cron installs the 
+scheduled jobs in crontab, which keep grades (among other things) up to date.'''
 elif sys.argv[1] == "local":
     os.system("cp options/local_options.py ohms/options.py")
 else:
@@ -29,5 +37,7 @@ else:
         static_deploy()
     elif sys.argv[2] == "code":
         code_deploy()
+    elif sys.argv[2] == "cron":
+        cron_deploy()
 
 
@@ -6,6 +6,7 @@ Initializes the database from scratch.
 
 from ohms.objects import *
 import elementtree.ElementTree as ET
+import os
 import sys
 
 def prod_init_db(file):
@@ -13,10 +14,15 @@ def prod_init_db(file):
     from ohms.base import Base, session, engine
 
     Base.metadata.create_all(engine)
-    node = ET.parse(file).getroot()
-    homework = Homework.from_xml(node)
+    from ohms.migrations import upgrade
+    upgrade()
+    from ohms.xml_import import parse_homework, import_questions
+    attributes, questions = parse_homework(file)
+    name = attributes.get("name") or os.path.splitext(os.path.basename(file))[0]
+    homework = Homework(name=name)
     session.add(homework)
-    session.commit()
+    session.flush()
+    import_questions(homework, questions)
 
 def add_sample_responses(question_id):
 
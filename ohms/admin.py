@@ -85,7 +85,7 @@ OHMS
 
 P.S. This is an automatically generated message ;-)""")
 
-    return "Sent reminder to %d recipients. You should have received an e-mail." % len(users)
+    return "Queued a reminder to %d recipients. You should receive an e-mail shortly." % len(users)
     
 @app.errorhandler(Exception)
 def handle_exceptions(error):
@@ -0,0 +1,414 @@
+"""
+admin_views.py
+
+The views for the admin pages and for editing homeworks.
+
+Students never need these, so app.py only imports this module the first
+time one of these pages is requested. This keeps the XML tools, the CSV
+exports and NumPy (for the gradebook) out of the start-up of every CGI
+request.
+"""
+
+from flask import Response, request, render_template, redirect, url_for, stream_with_context
+import json
+import csv
+from datetime import datetime
+import xml.etree.ElementTree as ET
+
+from base import read_only
+from objects import session, Homework, Question, User, GradingTask, Category
+from queries import get_homework, get_homeworks_before, get_question, get_question_response, \
+    get_all_responses_to_question, upsert_grade, get_users
+import options
+from auth import validate_user, validate_admin, forget_identity
+from utils import csv_lines, gzip_chunks
+from gradebook import compute_gradebook
+from grading import mark_dirty, mark_everything_dirty, mark_homeworks_dirty, \
+    mark_student_dirty, refresh_grades, update_top_scores
+
+
+def refresh_all_grades():
+    """
+    This recomputes all students' grades on all past due homeworks.
+    """
+    admin = validate_admin()
+    mark_everything_dirty()
+    return "Successfully updated %d grades." % refresh_grades()
+
+def refresh_materials_listing():
+    """
+    Lists the materials directory again, for when a file was replaced
+    without changing the directory.
+    """
+    admin = validate_admin()
+    from materials import refresh_materials
+    refresh_materials()
+    return redirect(url_for('materials'))
+
+def admin():
+    admin = validate_admin()
+
+    # change back to admin view
+    admin.proxy = admin.stuid
+    session.commit()
+    forget_identity()
+
+    homeworks = get_homework()
+    categories = session.query(Category).all()
+
+    users = get_users()
+    guests = []
+    admins = []
+    for user in users:
+        if user.type == "guest":
+            guests.append(user)
+        elif user.type == "admin":
+            admins.append(user)
+
+    gradebook, max_scores = get_gradebook()
+
+    # recent requests to this server process, if they are being profiled
+    profiles = None
+    if options.profile_requests:
+        from profiling import recent
+        profiles = recent()
+    
+    return render_template("admin/index.html", homeworks=homeworks, 
+                           guests=guests, admins=admins, categories=categories,
+                           gradebook=gradebook, max_scores=max_scores, options=options,
+                           profiles=profiles)
+
+def csv_response(lines, filename):
+    """
+    helper function that streams CSV lines as a download,
+    gzipped if the request asks for it
+    """
+    if request.args.get("gzip"):
+        response = Response(stream_with_context(gzip_chunks(lines)),
+                            content_type="application/gzip")
+        filename += ".gz"
+    else:
+        response = Response(stream_with_context(lines), content_type="text/csv")
+    response.headers["Content-Disposition"] = "attachment; filename=%s" % filename
+    return response
+
+@read_only
+def download_grades():
+    admin = validate_admin()
+
+    def rows():
+        homeworks = get_homework()
+        categories = session.query(Category).all()
+
+        yield ["SUNet", "Student", "Overall"] + \
+            [c.name + " Total" for c in categories] + \
+            [hw.name for hw in homeworks]
+
+        gradebook, max_scores = get_gradebook()
+
+        yield ["", "MAXIMUM", ""] + ["" for c in categories] + \
+            [max_scores[hw.id] for hw in homeworks]
+
+        for student, grades in gradebook:
+            row = [student.stuid, student.name, grades["overall"]]
+            for category in categories:
+                row.append(grades[category.name])
+            for hw in homeworks:
+                if hw.id not in grades:
+                    row.append("")
+                else:
+                    row.append("E" if grades[hw.id].excused else grades[hw.id].score)
+            yield row
+
+    course = options.title.replace(" ", "")
+    date = datetime.now().strftime("%m-%d-%Y")
+    return csv_response(csv_lines(rows()), "%sGrades%s.csv" % (course, date))
+
+@read_only
+def download_peer_reviews():
+    admin = validate_admin()
+
+    def rows():
+        yield ["grader", "student", "question", "score", "comments", "rating"]
+        tasks = session.query(GradingTask.grader, GradingTask.student,
+                              GradingTask.question_id, GradingTask.score,
+                              GradingTask.comments, GradingTask.rating).\
+            order_by(GradingTask.id).yield_per(500)
+        for task in tasks:
+            yield task
+
+    course = options.title.replace(" ", "")
+    return csv_response(csv_lines(rows(), quoting=csv.QUOTE_ALL),
+                        "%sPeerAssessments.csv" % course)
+
+def get_gradebook():
+    """
+    helper function that gets the gradebook
+    """
+
+    user = validate_user()
+
+    if user.type == "admin":
+        homeworks = get_homework()
+    else:
+        homeworks = get_homeworks_before()
+
+    return compute_gradebook(homeworks)
+
+def change_user_type():
+    admin = validate_admin()
+
+    stuid = request.form['user']
+    user_type = request.form['type']
+
+    session.query(User).filter_by(stuid=stuid).update({
+        "type": user_type
+    })
+    if user_type == "student":
+        mark_student_dirty(stuid)
+    # the student's grades may no longer count towards the class maximums
+    update_top_scores(hw.id for hw in get_homework())
+    session.commit()
+
+    return "Successfully changed user %s to %s." % (stuid, user_type)
+
+def move_question():
+    admin = validate_admin()
+
+    q_id = int(request.form['q_id'])
+    hw_id = int(request.form['hw_id'])
+
+    question = get_question(q_id)
+    # the grades on both homeworks change
+    mark_homeworks_dirty([question.hw_id, hw_id or None])
+    question.hw_id = hw_id if hw_id else None
+    question.invalidate_html()
+    session.commit()
+
+    if hw_id:
+        return "Question ID %d moved to <a href=hw?id=%d>%s</a>." % (q_id, question.homework.id, question.homework.name)
+    else:
+        return "Question ID %d has been deleted!" % q_id
+
+    
+def update_question():
+    admin = validate_admin()
+    
+    q_id = request.form['q_id']
+    xml_new = request.form['xml']
+    node = ET.fromstring(xml_new)
+    node.attrib['id'] = q_id
+    # Question.sync_from_node drops the cached HTML for this question
+    question = Question.from_xml(node)
+    return json.dumps({
+        "xml": question.xml,
+        "html": question.to_html(),
+    })
+        
+def update_response():
+    admin = validate_admin()
+
+    response_id = request.form["response_id"]
+    response = get_question_response(response_id)
+    score = request.form["score"]
+    response.score = float(score) if score else None
+    response.comments = request.form["comments"]
+    mark_dirty(response.stuid, response.question.hw_id)
+    session.commit()
+    refresh_grades([response.stuid])
+
+    return "Updated score for student %s to %f." % (response.stuid, response.score)
+    
+@read_only
+def view_responses():
+    admin = validate_admin()
+
+    q_id = request.args.get('q')
+    responses = get_all_responses_to_question(q_id)
+
+    return render_template("admin/view_responses.html", responses=responses, options=options)
+
+def change_user():
+    admin = validate_admin()
+    student = request.args['user']
+
+    if not session.query(User).get(student):
+        raise Exception("No user exists with the given ID.")
+
+    admin.proxy = student
+    session.commit()
+    forget_identity()
+
+    return redirect(url_for('hw_list'))
+
+def add_homework():
+    admin = validate_admin()
+
+    name = request.form['name']
+    start_date = datetime.strptime(request.form['start_date'],
+                                   "%m/%d/%Y %H:%M:%S")
+    due_date = datetime.strptime(request.form['due_date'],
+                                 "%m/%d/%Y %H:%M:%S")
+    category_id = request.form['category_id']
+
+    homework = Homework(name=name,
+                        start_date=start_date,
+                        due_date=due_date,
+                        category_id=category_id)
+    session.add(homework)
+    session.flush()
+    mark_homeworks_dirty([homework.id])
+    session.commit()
+
+    return "%s added successfully!" % name
+
+def import_homework():
+    admin = validate_admin()
+
+    hw_id = request.form['hw_id']
+    hw = get_homework(hw_id)
+
+    xml = request.files['xml'].read()
+    if not xml:
+        return "Empty file uploaded."
+
+    try:
+        hw.update_from_xml(xml)
+    except Exception as e:
+        return "Invalid XML uploaded, so nothing was imported. %s" % e
+
+    return "Homework updated successfully from XML."
+    
+
+@read_only
+def export_homework():
+    admin = validate_admin()
+
+    hw_id = request.args['id']
+    hw = get_homework(hw_id)
+
+    # each question's XML, without its IDs, wrapped in <homework> tags
+    from xml_export import homework_xml
+    return Response(stream_with_context(homework_xml(hw)), content_type='text')
+
+@read_only
+def export_course():
+    """
+    Streams the homeworks with the ids in the query string, or every
+    homework, as a .tar.gz archive of XML files
+    """
+    admin = validate_admin()
+
+    from xml_export import course_archive
+    homeworks = get_homework()
+    if request.args.get("ids"):
+        ids = set(int(i) for i in request.args["ids"].split(","))
+        homeworks = [hw for hw in homeworks if hw.id in ids]
+
+    course = options.title.replace(" ", "")
+    response = Response(stream_with_context(course_archive(homeworks)),
+                        content_type="application/gzip")
+    response.headers["Content-Disposition"] = "attachment; filename=%sHomeworks.tar.gz" % course
+    return response
+
+def update_hw_name():
+    admin = validate_admin()
+
+    hw_id = request.form['hw_id']
+    hw_name = request.form['hw_name']
+
+    homework = get_homework(hw_id)
+    homework.name = hw_name
+    session.commit()
+
+    return '''The homework name was successfully updated to "%s"!''' % homework.name
+
+
+def update_due_date():
+    admin = validate_admin()
+
+    hw_id = request.form['hw_id']
+    start_date = datetime.strptime(request.form['start_date'],
+                                   "%m/%d/%Y %H:%M:%S")
+    due_date = datetime.strptime(request.form['due_date'],
+                                 "%m/%d/%Y %H:%M:%S")
+    homework = get_homework(hw_id)
+    homework.start_date = start_date
+    homework.due_date = due_date
+    # grades are computed once the homework is due, which may now be sooner
+    mark_homeworks_dirty([homework.id])
+    session.commit()
+
+    return "Due date for %s updated successfully!" % homework.name
+
+def add_question():
+    admin = validate_admin()
+
+    xml = request.form['xml']
+    node = ET.fromstring(xml)
+
+    # remove any ID tags
+    for e in node.iter():
+        if "id" in e.attrib: e.attrib.pop("id")
+
+    question = Question.from_xml(node)
+    question.homework = get_homework(request.form['hw_id'])
+
+    session.commit()
+
+    return "Question added successfully!"
+
+def update_grade():
+    admin = validate_admin()
+
+    stuid = request.form['stuid']
+    hw_id = request.form['hw_id']
+    score = request.form['score'].strip()
+    excused = 1 if request.form['excused'] == "true" else 0
+
+    # check that score is valid
+    try:
+        float(score)
+    except:
+        assert(score in ["", "E"])
+
+    # fill in grades
+    upsert_grade(stuid, hw_id, score, excused)
+    update_top_scores([hw_id])
+    session.commit()
+
+    return "Grade update successful!"
+
+def update_max_score():
+    admin = validate_admin()
+
+    hw_id = request.form['hw_id']
+    max_score = request.form['max_score'].strip()
+
+    homework = get_homework(hw_id)
+    homework.max_score = None if max_score == "" else float(max_score)
+    session.commit()
+
+    return "The maximum score for %s has been successfully updated!" % homework.name
+
+def update_category():
+    admin = validate_admin()
+
+    name = request.form['name']
+    weight = float(request.form['weight'])
+    drops = int(request.form['drops'])
+
+    try:
+        category_id = int(request.form['id'])
+        category = session.query(Category).get(category_id)
+        category.name = name
+        category.weight = weight
+        category.drops = drops
+    except:
+        session.add(Category(name=name, weight=weight, drops=drops))
+
+    session.commit()
+
+    return "Category %s successfully added/updated." % name
+
+
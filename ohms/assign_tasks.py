@@ -1,14 +1,27 @@
 """
 assign_tasks.py
+
+Assigns peer grading tasks.
+
+Run `python assign_tasks.py due` from cron (or `python assign_tasks.py worker`
+as a long-running process) to assign the tasks for every peer reviewed
+question as soon as its homework is due, so that student pages only ever
+read tasks. Each run also gives students who responded after their
+question was assigned their self grading task.
 """
 
 import sys
+import time
 from datetime import datetime, timedelta
 import random
 
+from sqlalchemy.exc import IntegrityError
+
 from base import session
-from objects import User, Homework, Question, QuestionResponse, GradingTask, LongAnswerItem
-from queries import get_last_question_response, get_last_two_due_homeworks
+from objects import User, Homework, Question, QuestionResponse, GradingTask, LongAnswerItem, \
+    PeerAssignment
+from queries import get_last_two_due_homeworks, get_homework_questions, get_responders, \
+    insert_ignore, get_all_peer_tasks, get_peer_review_questions, get_question
 from send_email import send_all
 from pdt import pdt_now
 
@@ -19,22 +32,26 @@ def assign_tasks(hw_id, due_date, send_emails=False):
     
     users = session.query(User).filter(User.type == "student").order_by(User.stuid).all()
 
-    for q in homework.questions:
-        # only if this is a peer graded question
-        if not isinstance(q.items[0], LongAnswerItem):
-            continue
+    timings = []
+    start = time.time()
+
+    # only peer graded questions
+    questions = [q for q in get_homework_questions(hw_id)
+                 if q.items and isinstance(q.items[0], LongAnswerItem)]
+
+    # Figure out who did the homework, for all questions at once
+    responders = get_responders([q.id for q in questions])
+    timings.append(("fetch responders", time.time() - start))
+
+    for q in questions:
+        start = time.time()
 
         random.seed(q.id)  # setting a seed will be useful for debugging
 
-        responsible_kids = list()   # did the homework!
-        irresponsible_kids = list() # didn't do the homework!
+        responsible_kids = [u.stuid for u in users if u.stuid in responders[q.id]]       # did the homework!
+        irresponsible_kids = [u.stuid for u in users if u.stuid not in responders[q.id]] # didn't do the homework!
 
-        # Figure out who did the homework
-        for user in users:
-            if get_last_question_response(q.id, user.stuid):
-                responsible_kids.append(user.stuid)
-            else:
-                irresponsible_kids.append(user.stuid)
+        tasks = []
 
         # Make the assignments for the responsible kids
         n = len(responsible_kids)
@@ -44,36 +61,40 @@ def assign_tasks(hw_id, due_date, send_emails=False):
             # Make the assignments for this responsible student
             for offset in [1, 3, 6]:
                 j = (i + offset) % n
-                gt = GradingTask(grader=stuid,
-                                 student=responsible_kids[j],
-                                 question_id=q.id)
-                session.add(gt)
+                tasks.append({"grader": stuid,
+                              "student": responsible_kids[j],
+                              "question_id": q.id})
 
         # Make the assignments for the irresponsible kids:
         # Do so in round robin order, shuffling the responsible students again
         # to minimize the number of pairs of students grading together.
         random.shuffle(responsible_kids)
-        for i, stuid in enumerate(irresponsible_kids):
+        for i, stuid in enumerate(irresponsible_kids if n else []):
 
             # Make the assignments for this irresponsible student
             for offset in range(3):
                 j = (i * 3 + offset) % n
-                gt = GradingTask(grader=stuid,
-                                 student=responsible_kids[j],
-                                 question_id=q.id)
-                session.add(gt)
+                tasks.append({"grader": stuid,
+                              "student": responsible_kids[j],
+                              "question_id": q.id})
 
         # Make all self-assignments
         for stuid in (responsible_kids + irresponsible_kids):
-            gt = GradingTask(grader=stuid,
-                             student=stuid,
-                             question_id=q.id)
-            session.add(gt)
+            tasks.append({"grader": stuid,
+                          "student": stuid,
+                          "question_id": q.id})
+
+        # Write them all at once; tasks that already exist are skipped,
+        # so running this again does not create duplicates
+        insert_ignore(GradingTask.__table__, tasks)
+        timings.append(("question %d: %d tasks" % (q.id, len(tasks)), time.time() - start))
 
     session.commit()
 
+    report = "\n".join("%s (%.3fs)" % timing for timing in timings)
+
     if not send_emails:
-        return "Successfully assigned %d students"
+        return "Successfully assigned %d students.\n%s" % (len(users), report)
 
     # Send email notifications to all the students
     send_all(users, "Peer Assessment for %s is Ready" % homework.name[:-1],
@@ -104,8 +125,110 @@ OHMS
 P.S. This is an automatically generated message ;-)
 """.format(due_date=due_date.strftime("%A, %b %d at %I:%M %p")))
 
-    return r'''Successfully assigned %d students. You should have received an 
-e-mail confirmation.''' % len(users)
+    return r'''Successfully assigned %d students. You should receive an 
+e-mail confirmation once the outbox is sent.
+%s''' % (len(users), report)
+
+
+def peer_review_tasks(prq, responders):
+    """
+    Returns the grading tasks for the question reviewed by `prq`, given
+    the students who responded to it. Each responder grades as many peers
+    as the peer review has <peer> elements, and themselves if it has <self>.
+    """
+    responders = sorted(responders)
+    random.seed(prq.question_id)
+    random.shuffle(responders)
+
+    tasks = []
+    m, n = len(prq.peer_pts), len(responders)
+    for i, stuid in enumerate(responders):
+        for offset in [k*(k+1)/2 for k in range(1, m+1)]:
+            j = (i + offset) % n
+            tasks.append({"grader": stuid, "student": responders[j], "question_id": prq.question_id})
+    return tasks + self_review_tasks(prq, responders)
+
+def self_review_tasks(prq, responders):
+    """Returns the self grading tasks for `prq`, if it has <self>, one per responder"""
+    if prq.self_pts is None:
+        return []
+    return [{"grader": stuid, "student": stuid, "question_id": prq.question_id}
+            for stuid in sorted(responders)]
+
+def assign_peer_review(prq):
+    """
+    Assigns the grading tasks for the question reviewed by `prq`, exactly
+    once. The PeerAssignment row is inserted in the same transaction as
+    the tasks, so a concurrent run blocks on it and then finds the question
+    already assigned. Returns the number of tasks created, or None if the
+    question had already been assigned.
+    """
+    if session.query(PeerAssignment).get(prq.question_id):
+        return None
+    assignment = PeerAssignment(question_id=prq.question_id, time=pdt_now())
+    session.add(assignment)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        return None
+
+    # peer tasks assigned before this table existed are kept as they are,
+    # but the responders still get their self grading tasks
+    responders = get_responders([prq.question_id])[prq.question_id]
+    if get_all_peer_tasks(prq.question_id):
+        tasks = self_review_tasks(prq, responders)
+    else:
+        tasks = peer_review_tasks(prq, responders)
+    insert_ignore(GradingTask.__table__, tasks)
+    assignment.tasks = len(tasks)
+    session.commit()
+    return len(tasks)
+
+def assign_due_peer_reviews():
+    """Assigns the tasks for every peer reviewed question whose homework is due"""
+    assigned = []
+    now = pdt_now()
+    done = set(q_id for q_id, in session.query(PeerAssignment.question_id))
+    prqs = get_peer_review_questions()
+    for prq in prqs:
+        prq.set_metadata()
+        if prq.question_id in done:
+            continue
+        question = get_question(prq.question_id)
+        if question is None or question.homework is None or question.homework.due_date > now:
+            continue
+        start = time.time()
+        n = assign_peer_review(prq)
+        if n is not None:
+            assigned.append((question, n, time.time() - start))
+        done.add(prq.question_id)
+    assign_late_self_reviews(prqs, done)
+    return assigned
+
+def assign_late_self_reviews(prqs, assigned):
+    """
+    Adds the self grading tasks of students who responded to an assigned
+    question after its tasks were made (after an admin moved the due date,
+    say), so that they can still earn the <self> points. Tasks that
+    already exist are skipped.
+    """
+    prqs = [prq for prq in prqs if prq.self_pts is not None and prq.question_id in assigned]
+    responders = get_responders([prq.question_id for prq in prqs])
+    tasks = []
+    for prq in prqs:
+        tasks.extend(self_review_tasks(prq, responders[prq.question_id]))
+    insert_ignore(GradingTask.__table__, tasks)
+    session.commit()
+
+def run_worker(interval=60):
+    """Assigns peer reviews as homeworks come due, checking every `interval` seconds"""
+    while True:
+        for question, n, seconds in assign_due_peer_reviews():
+            print "Assigned %d tasks for %s, %s (%.3fs)" % (
+                n, question.homework.name, question.name, seconds)
+        session.close()
+        time.sleep(interval)
 
 
 def auto_assign():
@@ -125,4 +248,14 @@ def auto_assign():
 
 
 if __name__ == "__main__":
-    auto_assign()
+    command = sys.argv[1] if len(sys.argv) > 1 else "auto"
+    if command == "due":
+        for question, n, seconds in assign_due_peer_reviews():
+            print "Assigned %d tasks for %s, %s (%.3fs)" % (
+                n, question.homework.name, question.name, seconds)
+    elif command == "worker":
+        run_worker(int(sys.argv[2]) if len(sys.argv) > 2 else 60)
+    elif command == "auto":
+        auto_assign()
+    else:
+        print "The command is: python assign_tasks.py (auto/due/worker [seconds])"
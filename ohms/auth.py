@@ -2,50 +2,177 @@
 auth.py
 
 Abstracted out authorization routines.
+
+The logged-in user, and the user they are viewing the site as (an admin's
+proxy), are looked up once per request and kept on flask.g. If
+options.identity_token_secret is set, they are also saved in a signed
+cookie for options.identity_token_ttl seconds, so that the next requests
+from the same WebAuth user do not have to query the users table at all.
+Admins are always looked up, so that an admin who is demoted loses their
+rights at once, rather than when their cookie expires.
 """
-import options, os
+import options
+from flask import request, g
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy.orm import make_transient_to_detached
+from base import Session
 from objects import session, User
 from queries import get_user
 
+IDENTITY_COOKIE = "ohms_identity"
+USER_COLUMNS = ("stuid", "name", "type", "proxy")
+
 def auth():
     if options.target == "local":
         stuid = "test"
         name = "Test User"
     else:
-        stuid = os.environ.get("WEBAUTH_USER")
-        name = os.environ.get("WEBAUTH_LDAP_DISPLAYNAME")
+        # CGI copies these into the WSGI environ; wsgi.py sets them from the proxy
+        stuid = request.environ.get("WEBAUTH_USER")
+        name = request.environ.get("WEBAUTH_LDAP_DISPLAYNAME")
     return stuid, name
 
-def validate_user():
+def add_user(user):
+    """
+    Adds a user in a transaction of its own, so that even a read-only
+    page can create the user on their first visit. Returns the user, as
+    loaded by the request's session.
+    """
+    from grading import mark_student_dirty
+    stuid = user.stuid
+    s = Session()
+    try:
+        s.add(user)
+        s.flush()
+        # so that they are graded, if only with 0, on every homework
+        if user.type == "student":
+            mark_student_dirty(stuid, s)
+        s.commit()
+    finally:
+        s.close()
+    # start a new transaction, which can see the new row
+    session.rollback()
+    return get_user(stuid)
+
+def identity_serializer():
+    if not options.identity_token_secret:
+        return None
+    return URLSafeTimedSerializer(options.identity_token_secret, salt="ohms-identity")
+
+def user_to_dict(user):
+    if user is None:
+        return None
+    return dict((column, getattr(user, column)) for column in USER_COLUMNS)
+
+def user_from_dict(d):
+    """Attaches a user to the session from saved columns, without a query"""
+    if d is None:
+        return None
+    user = User(**d)
+    make_transient_to_detached(user)
+    return session.merge(user, load=False)
+
+def read_identity_token(stuid):
+    """Returns (user, proxy user) from the identity cookie, or None if it is missing or invalid"""
+    serializer = identity_serializer()
+    token = request.cookies.get(IDENTITY_COOKIE)
+    if serializer is None or token is None or g.get("identity_changed"):
+        return None
+    try:
+        data = serializer.loads(token, max_age=options.identity_token_ttl)
+    except BadSignature:
+        return None
+    # the cookie must belong to whoever is logged in now
+    if data["user"]["stuid"] != stuid:
+        return None
+    # admin rights are only ever taken from the users table
+    if data["user"]["type"] == "admin":
+        return None
+    return user_from_dict(data["user"]), user_from_dict(data["as"])
+
+def save_identity(response):
+    """
+    Sets the identity cookie when the identity was looked up in this
+    request, or deletes it when it has changed. Registered with
+    app.after_request.
+    """
+    serializer = identity_serializer()
+    if serializer is None:
+        return response
+    if g.get("identity_from_db") and "auth_user" in g and g.auth_user.type != "admin":
+        token = serializer.dumps({"user": user_to_dict(g.auth_user),
+                                  "as": user_to_dict(g.user)})
+        response.set_cookie(IDENTITY_COOKIE, token, max_age=options.identity_token_ttl,
+                            httponly=True, secure=request.is_secure)
+    elif g.get("identity_changed") or (g.get("identity_from_db") and IDENTITY_COOKIE in request.cookies):
+        response.delete_cookie(IDENTITY_COOKIE)
+    return response
+
+def forget_identity():
+    """
+    Call after changing the logged-in user, e.g. an admin's proxy. The
+    next call to validate_user looks them up again, and the identity
+    cookie is replaced.
+    """
+    g.pop("auth_user", None)
+    g.pop("user", None)
+    g.identity_from_db = False
+    g.identity_changed = True
+
+def load_identity():
+    """Looks up the logged-in user and their proxy once per request"""
+    if "auth_user" in g:
+        return
 
     stuid, name = auth()
 
+    identity = read_identity_token(stuid)
+    if identity is not None:
+        g.auth_user, g.user = identity
+        return
+
     try:
         user = get_user(stuid)
     except:
         type = "admin" if stuid in options.admins else "student"
-        user = User(stuid=stuid,
-                    name=name,
-                    type=type)
-        session.add(user)
-        session.commit()
+        user = add_user(User(stuid=stuid,
+                             name=name,
+                             type=type))
 
+    g.auth_user = user
     if user.type == "admin" and user.proxy:
-        user = session.query(User).get(user.proxy)
+        g.user = session.query(User).get(user.proxy)
+    else:
+        g.user = user
+    g.identity_from_db = True
 
-    return user
+def validate_user():
+    load_identity()
+    return g.user
 
 def validate_admin():
-
-    stuid, name = auth()
-
-    user = get_user(stuid)
+    load_identity()
+    user = g.auth_user
+    if not user.type == "admin" and not g.get("identity_from_db"):
+        # the cookie may be from before the user was made an admin
+        session.expire(user)
+        forget_identity()
+        load_identity()
+        user = g.auth_user
     if not user.type == "admin":
         if user.stuid in options.admins:
-            session.query(User).filter_by(stuid=user.stuid).update({
-                "type": "admin"
-            })
-            session.commit()
+            s = Session()
+            try:
+                s.query(User).filter_by(stuid=user.stuid).update({
+                    "type": "admin"
+                })
+                s.commit()
+            finally:
+                s.close()
+            session.rollback()
+            forget_identity()
+            load_identity()
+            user = g.auth_user
         else:
             raise Exception("You are not authorized to view this page.")
     return user
@@ -4,13 +4,52 @@ base.py
 A base file for sqlalchemy to avoid cyclic imports
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from functools import wraps
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from options import get_db
+import options
 
 Base = declarative_base()
-engine = create_engine(get_db(), echo=False)
 
+def engine_options(url):
+    """Pool settings from options.py; SQLite has no connection pool to size"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {"pool_size": options.db_pool_size,
+            "max_overflow": options.db_max_overflow,
+            "pool_recycle": options.db_pool_recycle,
+            "pool_pre_ping": options.db_pool_pre_ping}
+
+db_url = get_db()
+engine = create_engine(db_url, echo=False, **engine_options(db_url))
+
+# one session per thread; app.py removes it at the end of each request
 Session = sessionmaker(bind=engine)
-session = Session()
+session = scoped_session(Session)
+
+
+def read_only(view):
+    """
+    Decorator for views that never write to the database. Their
+    transactions are started READ ONLY (on MySQL), and any attempt to
+    flush changes raises an exception.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        session.info["read_only"] = True
+        return view(*args, **kwargs)
+    return wrapper
+
+@event.listens_for(Session, "after_begin")
+def start_read_only(s, transaction, connection):
+    if s.info.get("read_only") and connection.dialect.name == "mysql":
+        connection.execute("SET TRANSACTION READ ONLY")
+
+@event.listens_for(Session, "before_flush")
+def check_read_only(s, flush_context, instances):
+    # objects re-parsed from their XML are marked dirty, but have no real changes
+    if s.info.get("read_only") and (s.new or s.deleted or any(s.is_modified(o) for o in s.dirty)):
+        raise Exception("This page cannot make changes to the database.")
@@ -0,0 +1,161 @@
+"""
+benchmark.py
+
+Times the main pages through Flask's test client, and counts the SQL
+queries each one makes. Build a course to run against with synthetic.py
+first; the benchmark adds submissions to it, so rebuild it to compare
+runs exactly:
+
+    python synthetic.py 200 8
+    python benchmark.py [n] [endpoint ...]
+
+Student pages are requested as a different student each time, by making
+the admin "test" a proxy for them, as the admin page does.
+"""
+
+import sys
+import time
+
+from sqlalchemy import event
+
+from base import engine, session
+from objects import User, Homework, PeerReview, LongAnswerItem
+from pdt import pdt_now
+from utils import percentile
+
+ADMIN = "test"
+
+
+class QueryCounter(object):
+    """Counts the statements sent to the database while it is active"""
+
+    def __init__(self):
+        self.count = 0
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(engine, "before_cursor_execute", self.before_execute)
+
+
+def course():
+    """Returns the students, a past due homework and an open homework"""
+    students = [u.stuid for u in session.query(User).filter_by(type="student").order_by(User.stuid)]
+    homeworks = session.query(Homework).order_by(Homework.due_date).all()
+    now = pdt_now()
+    due = [hw for hw in homeworks if hw.due_date <= now]
+    not_due = [hw for hw in homeworks if hw.due_date > now]
+    if not students or not due or not not_due:
+        raise Exception("Run synthetic.py first: the benchmark needs students, "
+                        "and homeworks that are due and not yet due.")
+    return students, due[-1], not_due[0]
+
+def regular_question(hw):
+    """Returns the id of a question in hw that is graded automatically"""
+    for q in hw.questions:
+        if not isinstance(q, PeerReview) and q.items and not isinstance(q.items[0], LongAnswerItem):
+            return q.id, len(q.items)
+    raise Exception("%s has no automatically graded questions." % hw.name)
+
+def endpoints():
+    """
+    Returns (name, as student, method, path, data) for each page. Pages
+    requested as a student are requested as someone else each time.
+    """
+    students, due, not_due = course()
+    q_id, n_items = regular_question(not_due)
+    session.remove()
+    return students, [
+        ("/list", True, "GET", "/list", None),
+        ("/grades", True, "GET", "/grades", None),
+        ("/hw", True, "GET", "/hw?id=%d" % not_due.id, None),
+        ("/hw (admin)", False, "GET", "/hw?id=%d" % not_due.id, None),
+        ("/load_hw", True, "GET", "/load_hw?hw_id=%d" % due.id, None),
+        ("/submit", True, "POST", "/submit?q_id=%d" % q_id, {"responses": ["0"] * n_items}),
+        ("/admin", False, "GET", "/admin", None),
+        ("/download_grades", False, "GET", "/download_grades", None),
+    ]
+
+def act_as(stuid):
+    """Makes the admin see the site as the given user"""
+    session.query(User).filter_by(stuid=ADMIN).update({"proxy": stuid})
+    session.commit()
+    session.remove()
+
+def time_endpoint(client, students, as_student, method, path, data, n):
+    """Returns the seconds taken and queries made by each of n requests"""
+    times, queries = [], []
+    for i in range(n):
+        act_as(students[i % len(students)] if as_student else ADMIN)
+        counter = QueryCounter()
+        with counter:
+            start = time.time()
+            response = client.open(path, method=method, data=data)
+            response.get_data()
+            times.append(time.time() - start)
+        queries.append(counter.count)
+        if response.status_code != 200:
+            raise Exception("%s %s returned %d: %s" % (method, path, response.status_code,
+                                                       response.get_data()[:200]))
+    return times, queries
+
+def time_assign_tasks(n):
+    """Times assigning the grading tasks for the last past due homework, which is idempotent"""
+    from assign_tasks import assign_tasks
+    _, due, _ = course()
+    hw_id, due_date = due.id, due.due_date
+    session.remove()
+    times, queries = [], []
+    for _ in range(n):
+        counter = QueryCounter()
+        with counter:
+            start = time.time()
+            assign_tasks(hw_id, due_date)
+            times.append(time.time() - start)
+        queries.append(counter.count)
+        session.remove()
+    return times, queries
+
+def run(n=20, names=None):
+    """Returns (name, times, query counts) for each endpoint, or just the ones named"""
+    from app import app
+    # the same environment as CGI under WebAuth, for targets other than local
+    client = app.test_client(use_cookies=False)
+    client.environ_base.update({"WEBAUTH_USER": ADMIN,
+                                "WEBAUTH_LDAP_DISPLAYNAME": "Test User"})
+    students, pages = endpoints()
+    results = []
+    try:
+        for name, as_student, method, path, data in pages:
+            if names and name not in names:
+                continue
+            # the first request fills the caches, and is not counted
+            time_endpoint(client, students, as_student, method, path, data, 1)
+            times, queries = time_endpoint(client, students, as_student, method, path, data, n)
+            results.append((name, times, queries))
+        if not names or "assign_tasks" in names:
+            results.append(("assign_tasks",) + time_assign_tasks(n))
+    finally:
+        act_as(ADMIN)
+    return results
+
+def print_results(results):
+    print "%-20s %5s %9s %9s %9s %9s %9s" % (
+        "endpoint", "n", "mean ms", "p50 ms", "p95 ms", "max ms", "queries")
+    for name, times, queries in results:
+        low, high = min(queries), max(queries)
+        print "%-20s %5d %9.1f %9.1f %9.1f %9.1f %9s" % (
+            name, len(times), 1000 * sum(times) / len(times),
+            1000 * percentile(times, 50), 1000 * percentile(times, 95), 1000 * max(times),
+            low if low == high else "%d-%d" % (low, high))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print_results(run(n, sys.argv[2:]))
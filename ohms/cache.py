@@ -0,0 +1,71 @@
+"""
+cache.py
+
+Small in-process caches, used to avoid re-parsing question XML.
+"""
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+def content_hash(*texts):
+    """Returns a hash of the given strings, used to detect changes to XML"""
+    h = hashlib.sha1()
+    for text in texts:
+        if text is None:
+            text = u""
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        h.update(text)
+        h.update("\0")
+    return h.hexdigest()
+
+class LRUCache(object):
+    """
+    A dict-like cache that holds at most `maxsize` entries, evicting the
+    least recently used entry when it is full. Keeps hit/miss counts.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, match):
+        """Removes every entry whose key satisfies the predicate `match`"""
+        with self._lock:
+            for key in [k for k in self._data if match(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,82 @@
+"""
+expressions.py
+
+A small arithmetic evaluator for expression answers.
+
+Only numbers, parentheses, +, -, *, / and ** are understood. Every number is
+evaluated as a float, so each operation takes constant time, and the cost of
+evaluating an expression is bounded by the limits on its length, number of
+nodes and exponent size below.
+"""
+
+from __future__ import division
+import ast
+import math
+import operator
+
+# limits on what a single expression may contain
+MAX_LENGTH = 200
+# numbers and operations; each takes at least one character, so this only
+# matters if MAX_LENGTH is raised
+MAX_NODES = 200
+MAX_EXPONENT = 1000
+
+NOT_UNDERSTOOD = "I'm sorry, but I did not understand the expression you typed in. Please check the expression and try again."
+
+BINARY_OPERATORS = {ast.Add: operator.add,
+                    ast.Sub: operator.sub,
+                    ast.Mult: operator.mul,
+                    ast.Div: operator.truediv,
+                    ast.Pow: operator.pow}
+
+UNARY_OPERATORS = {ast.UAdd: operator.pos,
+                   ast.USub: operator.neg}
+
+class ExpressionError(Exception):
+    pass
+
+class Expression(object):
+    """An arithmetic expression, parsed once and checked against the limits"""
+
+    __slots__ = ("text", "tree")
+
+    def __init__(self, text):
+        if len(text) > MAX_LENGTH:
+            raise ExpressionError("Your expression is too long. Please simplify it and try again.")
+        try:
+            self.tree = ast.parse(text, mode="eval").body
+        except (SyntaxError, ValueError, MemoryError):
+            raise ExpressionError(NOT_UNDERSTOOD)
+        # ast.walk also yields operators (Add, USub, ...), which are not counted
+        if sum(1 for node in ast.walk(self.tree) if isinstance(node, ast.expr)) > MAX_NODES:
+            raise ExpressionError("Your expression is too long. Please simplify it and try again.")
+        self.text = text
+
+    def evaluate(self):
+        try:
+            return evaluate_node(self.tree)
+        except ZeroDivisionError:
+            raise ExpressionError("Your expression divides by zero. Please check it and try again.")
+        except (OverflowError, ValueError):
+            # a float can only hold numbers up to about 10**308
+            raise ExpressionError("Your expression could not be evaluated, because a number in it is too large. Please simplify it and try again.")
+
+def evaluate_node(node):
+    if isinstance(node, ast.Num) and isinstance(node.n, (int, long, float)):
+        value = float(node.n)
+    elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        left, right = evaluate_node(node.left), evaluate_node(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > MAX_EXPONENT:
+            raise ExpressionError("The exponents in your expression are too large.")
+        value = BINARY_OPERATORS[type(node.op)](left, right)
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        value = UNARY_OPERATORS[type(node.op)](evaluate_node(node.operand))
+    else:
+        raise ExpressionError(NOT_UNDERSTOOD)
+    if not isinstance(value, float) or math.isinf(value) or math.isnan(value):
+        raise ValueError("expression did not evaluate to a finite number")
+    return value
+
+def evaluate(text):
+    """Parses and evaluates an arithmetic expression, returning a float"""
+    return Expression(text).evaluate()
@@ -0,0 +1,164 @@
+"""
+gradebook.py
+
+Computes the gradebook with array operations.
+
+All of the grades are fetched as plain columns in one query and laid out
+as (student x homework) arrays, so that maximum scores, drops, category
+totals and overall scores are computed for the whole class at once. A
+single student's grades are computed the same way, from a one-row array.
+"""
+
+from __future__ import division
+import numpy as np
+
+from base import session
+from objects import User, Grade, Category
+from utils import convert_to_last_name
+
+
+class GradeEntry(object):
+    """A student's grade on a homework, as displayed in the gradebook"""
+    __slots__ = ("score", "excused")
+
+    def __init__(self, score, excused):
+        self.score = score
+        self.excused = excused
+
+def to_float(score):
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return np.nan
+
+def load_grades(students, homeworks, grades):
+    """
+    Lays out (stuid, hw_id, score, excused) rows as (student x homework)
+    arrays. Returns the scores (nan if missing or not a number), the
+    excused flags and a list of GradeEntry dicts, one per student.
+    """
+    row = dict((s.stuid, i) for i, s in enumerate(students))
+    col = dict((hw.id, j) for j, hw in enumerate(homeworks))
+    shape = (len(students), len(homeworks))
+
+    scores = np.full(shape, np.nan)
+    excused = np.zeros(shape, dtype=bool)
+    entries = [{} for _ in students]
+
+    for stuid, hw_id, score, is_excused in grades:
+        i, j = row[stuid], col[hw_id]
+        scores[i, j] = to_float(score)
+        excused[i, j] = bool(is_excused)
+        entries[i][hw_id] = GradeEntry(score, is_excused)
+
+    return scores, excused, entries
+
+def add_totals(entries, scores, excused, homeworks, max_scores):
+    """Adds the category totals and overall score to each student's grades"""
+
+    categories = session.query(Category).all()
+    hw_ids = [hw.id for hw in homeworks]
+
+    # unparseable and missing scores count as zero
+    earned = np.nan_to_num(scores)
+    overall = np.zeros(len(entries))
+
+    for category in categories:
+        # homeworks in this category that count towards the grade
+        cols = [j for j, hw in enumerate(homeworks)
+                if hw.category_id == category.id and max_scores[hw.id]]
+        if not cols:
+            for grades in entries:
+                grades[category.name] = "0 / 0"
+            continue
+
+        counted = ~excused[:, cols]
+        e_hw = np.where(counted, earned[:, cols], 0.)
+        p_hw = np.where(counted, np.array([max_scores[hw_ids[j]] for j in cols], dtype=float), 0.)
+        e, p = e_hw.sum(axis=1), p_hw.sum(axis=1)
+
+        # drop the homeworks that would raise the percentage the most
+        # when dropped, one at a time in order of that benefit
+        n = counted.sum(axis=1)
+        dropping = n > category.drops + 1
+        if category.drops and dropping.any():
+            with np.errstate(divide="ignore", invalid="ignore"):
+                benefit = (e[:, None] - e_hw) / (p[:, None] - p_hw)
+            benefit = np.where(counted, benefit, -np.inf)
+            order = np.argsort(-benefit, axis=1, kind="mergesort")[:, :category.drops]
+            rows = np.arange(len(entries))[:, None]
+            e = np.where(dropping, e - e_hw[rows, order].sum(axis=1), e)
+            p = np.where(dropping, p - p_hw[rows, order].sum(axis=1), p)
+
+        for i, grades in enumerate(entries):
+            if n[i] == 0:
+                grades[category.name] = "0 / 0"
+            else:
+                grades[category.name] = "%0.1f / %0.1f" % (e[i], p[i])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            overall += np.where(p > 0, category.weight * e / p, 0.)
+
+    for i, grades in enumerate(entries):
+        grades["overall"] = float(overall[i])
+
+def compute_gradebook(homeworks):
+    """
+    Returns the gradebook, a list of (student, grades) pairs sorted by last
+    name, and a dict of maximum scores by homework id. Each `grades` dict
+    maps homework ids to GradeEntry objects, category names to totals
+    ("earned / possible") and "overall" to the weighted overall score.
+    """
+
+    students = session.query(User).filter_by(type="student").all()
+    hw_ids = [hw.id for hw in homeworks]
+
+    grades = []
+    if hw_ids:
+        grades = session.query(Grade.stuid, Grade.hw_id, Grade.score, Grade.excused).\
+            join(User, User.stuid == Grade.stuid).\
+            filter(User.type == "student").\
+            filter(Grade.hw_id.in_(hw_ids)).all()
+    scores, excused, entries = load_grades(students, homeworks, grades)
+
+    # maximum scores default to the highest score in the class
+    highest = np.full(len(homeworks), np.nan)
+    if len(students):
+        has_score = ~np.isnan(scores).all(axis=0)
+        highest[has_score] = np.nanmax(scores[:, has_score], axis=0)
+    max_scores = {}
+    for j, hw in enumerate(homeworks):
+        if hw.max_score is not None:
+            max_scores[hw.id] = hw.max_score
+        elif not np.isnan(highest[j]):
+            max_scores[hw.id] = float(highest[j])
+        else:
+            max_scores[hw.id] = None
+
+    add_totals(entries, scores, excused, homeworks, max_scores)
+
+    gradebook = zip(students, entries)
+    gradebook.sort(key=lambda entry: convert_to_last_name(entry[0].name))
+
+    return gradebook, max_scores
+
+def compute_student_grades(student, homeworks):
+    """
+    Returns one student's grades, in the same form as an entry of the
+    gradebook, and the maximum scores. Only the student's own grades are
+    read; the class-wide default maximum scores come from Homework.top_score.
+    """
+
+    hw_ids = [hw.id for hw in homeworks]
+
+    grades = []
+    if hw_ids:
+        grades = session.query(Grade.stuid, Grade.hw_id, Grade.score, Grade.excused).\
+            filter(Grade.stuid == student.stuid).\
+            filter(Grade.hw_id.in_(hw_ids)).all()
+    scores, excused, entries = load_grades([student], homeworks, grades)
+
+    max_scores = dict((hw.id, hw.default_max_score) for hw in homeworks)
+
+    add_totals(entries, scores, excused, homeworks, max_scores)
+
+    return entries[0], max_scores
@@ -0,0 +1,120 @@
+"""
+graders.py
+
+Compiled answer keys for checking submissions without re-parsing item XML.
+"""
+
+from __future__ import division
+from cache import LRUCache, content_hash
+from expressions import evaluate
+import options
+
+# compiled graders, keyed by item id and a hash of the item XML
+grader_cache = LRUCache(options.grader_cache_size)
+
+def get_grader(item):
+    """Returns the compiled grader for an item, compiling it if necessary"""
+    key = (item.id, content_hash(item.xml))
+    grader = grader_cache.get(key)
+    if grader is None:
+        grader = item.compile_grader()
+        grader_cache.put(key, grader)
+    return grader
+
+
+class OptionKey(object):
+    __slots__ = ("points", "comment")
+
+    def __init__(self, points, comment):
+        self.points = points
+        self.comment = comment
+
+
+class AnswerKey(object):
+    __slots__ = ("type", "points", "comment", "lb", "ub", "exact", "value")
+
+    def __init__(self, answer):
+        self.type = answer.type
+        self.points = answer.points
+        self.comment = answer.comment
+        self.lb = getattr(answer, "lb", None)
+        self.ub = getattr(answer, "ub", None)
+        self.exact = getattr(answer, "exact", None)
+        # the instructor's expression is only ever evaluated once
+        self.value = evaluate(self.preprocess(self.exact)) if self.type == "expression" else None
+
+    @staticmethod
+    def validate(expr):
+        if expr.count("(") != expr.count(")"):
+            raise Exception("You have mismatched parentheses (...) in your expression.")
+        allowed_chars = [str(n) for n in range(10)]
+        allowed_chars.extend([".", "+", "-", "*", "/", "(", ")"])
+        diff = set(expr)-set(allowed_chars)
+        if diff:
+            non_ascii = [c for c in diff if ord(c)>=128]
+            if non_ascii:
+                raise Exception('''The character %s is not an ASCII character. Perhaps you copied and pasted from Microsoft Word, or have confused it with a similar character?''' % non_ascii[0])
+            else:
+                raise Exception("You have the following illegal characters in your expression: %s" % ", ".join(diff))
+        return True
+
+    @staticmethod
+    def preprocess(expr):
+        # remove all whitespace
+        expr = "".join(expr.split())
+        # replace x with *
+        expr = expr.replace("x", "*")
+        # replace ^ with **
+        expr = expr.replace("^", "**")
+        # convert parentheses to explicit multiplications
+        expr = expr.replace(")(", ")*(")
+        for i in range(10):
+            expr = expr.replace("%d(" % i, "%d*(" % i)
+        return expr
+
+    def is_correct(self, response):
+        if self.type == "range":
+            response = "".join([c for c in response if c in '1234567890.-'])
+            try:
+                num_response = float(response)
+            except ValueError:
+                raise Exception("I didn't understand your response. Please try again.")
+            return self.lb - 1e-10 <= num_response <= self.ub + 1e-10
+        elif self.type == "exact":
+            str_response = response.strip().lower()
+            return str_response == self.exact
+        elif self.type == "expression":
+            if response:
+                processed_response = self.preprocess(response)
+                self.validate(processed_response)
+                return abs(evaluate(processed_response) - self.value) < 1e-15
+        else:
+            raise Exception("Answer type not supported.")
+        return False
+
+
+class MultipleChoiceGrader(object):
+    __slots__ = ("options",)
+
+    def __init__(self, options):
+        self.options = tuple(OptionKey(o.points, o.comment) for o in options)
+
+    def check(self, response):
+        try:
+            option = self.options[int(response)]
+            return option.points, option.comment
+        except:
+            raise Exception("Invalid multiple choice answer.")
+
+
+class ShortAnswerGrader(object):
+    __slots__ = ("answers",)
+
+    def __init__(self, answers):
+        self.answers = tuple(AnswerKey(a) for a in answers)
+
+    def check(self, response):
+        for answer in self.answers:
+            if answer.is_correct(response):
+                return answer.points, answer.comment
+        return 0, ""
@@ -0,0 +1,177 @@
+"""
+grading.py
+
+Keeps the grades table up to date incrementally.
+
+Anything that can change a student's score on a homework (a submission,
+a peer review, a rating, an instructor's regrade) marks that (student,
+homework) pair dirty. `refresh_grades` then recomputes only the dirty
+grades on homeworks that are past due, in a single transaction, so that
+page views only ever have to read the grades table. A request that
+changes a grade recomputes only the grades of the students it marked.
+
+The rest are recomputed by running this file from cron (see the crontab
+in the top directory, which `python deploy.py prod cron` installs), which
+picks up the submissions made before each deadline once it has passed.
+"""
+
+from sqlalchemy import select
+
+from base import session
+from objects import Homework, PeerReview, User, DirtyGrade, Grade
+from queries import get_last_question_response, get_peer_tasks_for_student, \
+    get_peer_review_questions, upsert_grade, insert_ignore
+from pdt import pdt_now
+
+
+def mark_dirty(stuid, hw_id):
+    """Marks a student's grade on a homework as needing to be recomputed"""
+    if hw_id is None:
+        return
+    mark_all_dirty([(stuid, hw_id)])
+
+def mark_all_dirty(pairs, bind=None):
+    """Marks many (stuid, hw_id) pairs dirty with a single statement"""
+    # pairs that are already dirty are skipped by the unique constraint
+    insert_ignore(DirtyGrade.__table__,
+                  [{"stuid": stuid, "hw_id": hw_id} for stuid, hw_id in pairs], bind)
+
+def student_ids(bind=None):
+    users = User.__table__
+    return [stuid for stuid, in (bind or session).execute(
+        select([users.c.stuid]).where(users.c.type == "student"))]
+
+def homework_ids(bind=None):
+    return [hw_id for hw_id, in (bind or session).execute(select([Homework.__table__.c.id]))]
+
+def mark_homeworks_dirty(hw_ids):
+    """
+    Marks every student's grade on the given homeworks dirty, when a
+    homework is added or its questions or due date change. Students who
+    submit nothing are graded too, with 0, once the homework is due.
+    """
+    hw_ids = [hw_id for hw_id in hw_ids if hw_id is not None]
+    mark_all_dirty([(stuid, hw_id) for stuid in student_ids() for hw_id in hw_ids])
+
+def mark_student_dirty(stuid, bind=None):
+    """Marks a new student's grade on every homework dirty"""
+    mark_all_dirty([(stuid, hw_id) for hw_id in homework_ids(bind)], bind)
+
+def mark_reviewers_dirty(stuid, question_id):
+    """Marks dirty the peer review homeworks that review the given question"""
+    for prq in get_peer_review_questions():
+        prq.set_metadata()
+        if prq.question_id == int(question_id):
+            mark_dirty(stuid, prq.hw_id)
+
+def claim_dirty_grades(stuids=None):
+    """
+    Takes the dirty grades on past due homeworks (of the given students)
+    off the dirty list, and returns them as (stuid, hw_id) pairs. Each row
+    is deleted by its id, and only counted if this delete removed it, so
+    when cron and a request refresh at the same time, each grade is
+    recomputed by only one of them.
+    """
+    dirty = session.query(DirtyGrade.id, DirtyGrade.stuid, DirtyGrade.hw_id).\
+        join(Homework, DirtyGrade.hw_id == Homework.id).\
+        filter(Homework.due_date <= pdt_now())
+    if stuids is not None:
+        dirty = dirty.filter(DirtyGrade.stuid.in_(stuids))
+    claimed = []
+    for id, stuid, hw_id in dirty.all():
+        if session.query(DirtyGrade).filter(DirtyGrade.id == id).\
+                delete(synchronize_session=False) == 1:
+            claimed.append((stuid, hw_id))
+    return claimed
+
+def refresh_grades(stuids=None):
+    """
+    Recomputes every dirty grade on a homework that is past due, or only
+    those of the given students, and commits them together. Returns the
+    number of grades recomputed.
+    """
+    refreshed = 0
+    hw_ids = set()
+    while True:
+        dirty = claim_dirty_grades(stuids)
+        if not dirty:
+            break
+        # computing a peer review grade can mark the reviewed homework
+        # dirty, which is picked up on the next pass
+        for stuid, hw_id in dirty:
+            calculate_grade(session.query(User).get(stuid), session.query(Homework).get(hw_id))
+            hw_ids.add(hw_id)
+        refreshed += len(dirty)
+    update_top_scores(hw_ids)
+    session.commit()
+    return refreshed
+
+def calculate_grade(user, hw):
+    """
+    Computes a student's grade on a homework and writes it to the grades
+    table. Returns the score, or None if it cannot be determined yet.
+    """
+
+    # peer reviews determine the score of the response being reviewed
+    for q in hw.questions:
+        if isinstance(q, PeerReview):
+            q.set_metadata()
+            response = get_last_question_response(q.question_id, user.stuid)
+            if response and response.score is None:
+                tasks = get_peer_tasks_for_student(q.question_id, user.stuid)
+                scores = [t.score for t in tasks if t.score is not None]
+                response.score = sorted(scores)[len(scores) // 2] if scores else None
+                response.comments = "Click <a href='rate?id=%d' target='_blank'>here</a> to view comments." % q.question_id
+                if response.score is not None:
+                    mark_dirty(user.stuid, response.question.hw_id)
+
+    # total up the points
+    score = 0.
+    if len(hw.questions) == 0:
+        return None
+    for out in hw.load_responses(user).values():
+        if out['submission'] is None:
+            continue
+        elif out['submission'].score is None:
+            return None
+        else:
+            score += out['submission'].score
+
+    upsert_grade(user.stuid, hw.id, score)
+    return score
+
+def highest_scores(rows):
+    """Returns a dict of the highest numeric score in (hw_id, score) rows"""
+    top = {}
+    for hw_id, score in rows:
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            continue
+        if hw_id not in top or score > top[hw_id]:
+            top[hw_id] = score
+    return top
+
+def update_top_scores(hw_ids):
+    """Recomputes Homework.top_score, the highest student score, for the given homeworks"""
+    hw_ids = list(hw_ids)
+    if not hw_ids:
+        return
+    rows = session.query(Grade.hw_id, Grade.score).\
+        join(User, User.stuid == Grade.stuid).\
+        filter(User.type == "student").\
+        filter(Grade.hw_id.in_(hw_ids)).all()
+    top = highest_scores(rows)
+    for hw in session.query(Homework).filter(Homework.id.in_(hw_ids)).all():
+        hw.top_score = top.get(hw.id)
+
+def mark_everything_dirty(bind=None):
+    """
+    Marks every student's grade on every homework dirty. Grades on
+    homeworks that are not due yet are computed when they are.
+    """
+    hw_ids = homework_ids(bind)
+    mark_all_dirty([(stuid, hw_id) for stuid in student_ids(bind) for hw_id in hw_ids], bind)
+
+if __name__ == "__main__":
+    print "Recomputed %d grades." % refresh_grades()
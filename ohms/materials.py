@@ -0,0 +1,99 @@
+"""
+materials.py
+
+The listing of course materials in WWW/restricted/, for /materials.
+
+Reading a directory on AFS is slow, and every student sees the same
+listing, so the listing (with each file's size and modification time) is
+kept in memory and in `materials_cache_file`, shared by every process.
+It is read again when the directory's modification time changes, which
+happens when a file is added, removed or renamed. Overwriting a file in
+place does not change the directory, so admins can refresh the listing
+from the materials page, or with:
+
+    python materials.py
+"""
+
+import os
+import json
+import time
+import threading
+
+import options
+
+# the listing last read by this process
+listing = None
+listing_lock = threading.Lock()
+
+
+def materials_dir():
+    return "%s/WWW/restricted/" % options.base_dir
+
+def read_listing(path):
+    """Lists the files in the directory, with their sizes and modification times"""
+    # taken before listing, so that a change while listing makes it stale
+    built = time.time()
+    mtime = os.stat(path).st_mtime
+    files = []
+    for name in sorted(os.listdir(path)):
+        if name.startswith('.'):
+            continue
+        st = os.stat(os.path.join(path, name))
+        files.append({"name": name, "size": st.st_size, "mtime": st.st_mtime})
+    return {"path": path, "mtime": mtime, "built": built, "files": files}
+
+def is_current(cached, path, mtime):
+    """
+    Checks that the listing was read from this directory since it last
+    changed. Modification times may only count whole seconds, so a listing
+    read within a second of a change might have missed a second change.
+    """
+    return cached is not None and cached["path"] == path and \
+        cached["mtime"] == mtime and cached["built"] >= mtime + 1
+
+def load_cache_file():
+    try:
+        with open(options.materials_cache_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def save_cache_file(cached):
+    """Writes the listing to the cache file, replacing it all at once"""
+    path = options.materials_cache_file
+    tmp = "%s.%d" % (path, os.getpid())
+    try:
+        with open(tmp, "w") as f:
+            json.dump(cached, f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+def get_materials():
+    """Returns the files in the materials directory, as dicts with name, size and mtime"""
+    global listing
+    path = materials_dir()
+    mtime = os.stat(path).st_mtime
+    with listing_lock:
+        if is_current(listing, path, mtime):
+            return listing["files"]
+        cached = load_cache_file() if options.materials_cache_file else None
+        if not is_current(cached, path, mtime):
+            cached = read_listing(path)
+            if options.materials_cache_file:
+                save_cache_file(cached)
+        listing = cached
+        return listing["files"]
+
+def refresh_materials():
+    """Reads the directory again, whether or not it has changed"""
+    global listing
+    with listing_lock:
+        listing = read_listing(materials_dir())
+        if options.materials_cache_file:
+            save_cache_file(listing)
+        return listing["files"]
+
+
+if __name__ == "__main__":
+    print "Listed %d files in %s." % (len(refresh_materials()), materials_dir())
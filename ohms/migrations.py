@@ -0,0 +1,209 @@
+"""
+migrations.py
+
+Versioned schema migrations for existing databases.
+
+`Base.metadata.create_all` only creates tables that are missing, so
+changes to existing tables (such as new indexes) are applied here. Each
+migration is applied once, in order, and recorded in the schema_version
+table. Migrations check what already exists before changing anything,
+so it is safe to run them against a database created by create_all.
+
+Usage (from the ohms directory):
+
+    python migrations.py           # show the applied version
+    python migrations.py upgrade   # apply pending migrations
+    python migrations.py plans     # show query plans for queries.py
+"""
+
+import sys
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, event, inspect, func, select
+from base import Base, engine
+from pdt import pdt_now
+import objects
+
+metadata = MetaData()
+schema_version = Table("schema_version", metadata,
+                      Column("version", Integer, primary_key=True),
+                      Column("description", String(100)),
+                      Column("applied", DateTime))
+
+
+def create_tables(*names):
+    """Returns a migration that creates the given tables if they are missing"""
+    def migrate(connection):
+        tables = [Base.metadata.tables[name] for name in names]
+        Base.metadata.create_all(connection, tables=tables, checkfirst=True)
+    return migrate
+
+def create_indexes(*names):
+    """Returns a migration that creates the given indexes from objects.py"""
+    def migrate(connection):
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = [ix['name'] for ix in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name in names and index.name not in existing:
+                    index.create(connection)
+    return migrate
+
+def add_columns(table_name, *names):
+    """Returns a migration that adds the given columns from objects.py"""
+    def migrate(connection):
+        table = Base.metadata.tables[table_name]
+        existing = [c['name'] for c in inspect(connection).get_columns(table_name)]
+        for name in names:
+            if name not in existing:
+                column = table.c[name]
+                connection.execute("ALTER TABLE %s ADD COLUMN %s %s" % (
+                    table_name, name, column.type.compile(dialect=connection.dialect)))
+    return migrate
+
+def fill_top_scores(connection):
+    from grading import highest_scores
+    grades, users, hws = objects.Grade.__table__, objects.User.__table__, objects.Homework.__table__
+    rows = connection.execute(select([grades.c.hw_id, grades.c.score]).
+                              select_from(grades.join(users, users.c.stuid == grades.c.stuid)).
+                              where(users.c.type == "student")).fetchall()
+    for hw_id, score in highest_scores(rows).items():
+        connection.execute(hws.update().where(hws.c.id == hw_id).values(top_score=score))
+
+def mark_all_grades_dirty(connection):
+    """
+    Responses submitted before dirty_grades existed were never marked, so
+    every grade is recomputed (once each homework is due) after upgrading
+    """
+    from grading import mark_everything_dirty
+    mark_everything_dirty(connection)
+
+def run_all(*migrations):
+    """Returns a migration that runs several migrations in order"""
+    def migrate(connection):
+        for m in migrations:
+            m(connection)
+    return migrate
+
+# add new migrations to the end of this list; never reorder or remove them
+MIGRATIONS = [
+    (1, "add dirty_grades table", create_tables("dirty_grades")),
+    (2, "add indexes on responses, tasks, grades and users",
+     create_indexes("ix_question_responses_latest",
+                    "ix_grading_tasks_grader",
+                    "ix_grading_tasks_student",
+                    "ix_grades_hw_id",
+                    "ix_users_type")),
+    (3, "add hws.top_score",
+     run_all(add_columns("hws", "top_score"), fill_top_scores)),
+    (4, "add peer_assignments table", create_tables("peer_assignments")),
+    (5, "add outbox table", create_tables("outbox")),
+    (6, "add index on item_responses.question_response_id",
+     create_indexes("ix_item_responses_question_response")),
+    (7, "mark every grade dirty", mark_all_grades_dirty),
+]
+
+
+def current_version(connection):
+    metadata.create_all(connection, checkfirst=True)
+    version = connection.execute(select([func.max(schema_version.c.version)])).scalar()
+    return version or 0
+
+def pending_migrations(connection):
+    version = current_version(connection)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def upgrade():
+    """Applies all pending migrations, returns the list that was applied"""
+    applied = []
+    connection = engine.connect()
+    try:
+        for version, description, migrate in pending_migrations(connection):
+            trans = connection.begin()
+            migrate(connection)
+            connection.execute(schema_version.insert().values(
+                version=version, description=description, applied=pdt_now()))
+            trans.commit()
+            applied.append((version, description))
+    finally:
+        connection.close()
+    return applied
+
+
+def sample_queries():
+    """
+    Returns (name, function) pairs that run the hot queries in queries.py
+    against the first student and question in the database.
+    """
+    import queries
+    from base import session
+    # only select key columns, since other columns may not exist yet
+    def first(column, default):
+        value = session.execute(select([column]).limit(1)).scalar()
+        return default if value is None else value
+    stuid = first(objects.User.__table__.c.stuid, "")
+    q_id = first(objects.Question.__table__.c.id, 0)
+    hw_id = first(objects.Homework.__table__.c.id, 0)
+    return [
+        ("get_last_question_response", lambda: queries.get_last_question_response(q_id, stuid)),
+        ("get_last_question_responses", lambda: queries.get_last_question_responses([q_id], stuid)),
+        ("get_all_responses_to_question", lambda: queries.get_all_responses_to_question(q_id)),
+        ("get_all_peer_tasks", lambda: queries.get_all_peer_tasks(q_id)),
+        ("get_peer_tasks_for_grader", lambda: queries.get_peer_tasks_for_grader(q_id, stuid)),
+        ("get_self_tasks_for_student", lambda: queries.get_self_tasks_for_student(q_id, stuid)),
+        ("get_peer_tasks_for_student", lambda: queries.get_peer_tasks_for_student(q_id, stuid)),
+        ("get_tasks_for_grader", lambda: queries.get_tasks_for_grader([q_id], stuid)),
+        ("get_grade", lambda: queries.get_grade(stuid, hw_id)),
+        ("get_homework_grades", lambda: queries.get_homework_grades(hw_id)),
+    ]
+
+def query_plans():
+    """Returns (name, statement, plan rows) for each of the sample queries"""
+    from base import session
+    if engine.dialect.name == "sqlite":
+        explain = "EXPLAIN QUERY PLAN "
+    else:
+        explain = "EXPLAIN "
+
+    statements = []
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    plans = []
+    for name, run in sample_queries():
+        del statements[:]
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            run()
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        for statement, parameters in list(statements):
+            rows = session.connection().execute(explain + statement, parameters).fetchall()
+            plans.append((name, statement, rows))
+    session.rollback()
+    return plans
+
+def print_plans():
+    for name, statement, rows in query_plans():
+        print "== %s" % name
+        print " ".join(statement.split())
+        for row in rows:
+            print "    " + " | ".join(str(col) for col in row)
+        print
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    connection = engine.connect()
+    print "Schema version: %d (latest is %d)" % (current_version(connection), MIGRATIONS[-1][0])
+    connection.close()
+    if command == "upgrade":
+        print "\nQuery plans before upgrading:\n"
+        print_plans()
+        for version, description in upgrade():
+            print "Applied migration %d: %s" % (version, description)
+        print "\nQuery plans after upgrading:\n"
+        print_plans()
+    elif command == "plans":
+        print
+        print_plans()
+    elif command != "status":
+        print "The command is: python migrations.py (status/upgrade/plans)"
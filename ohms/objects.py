@@ -7,12 +7,17 @@ Defines the database objects.
 from __future__ import division
 import xml.etree.ElementTree as ET
 import re
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, UnicodeText, UniqueConstraint, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, UnicodeText, UniqueConstraint, Boolean, Index
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.orm.session import make_transient
 from base import Base, session
 from datetime import datetime, timedelta
 from pdt import pdt_now
+from cache import LRUCache, content_hash
+from graders import get_grader, MultipleChoiceGrader, ShortAnswerGrader
+import options
+
+# rendered question HTML, keyed by question id and a hash of the XML
+render_cache = LRUCache(options.render_cache_size)
 
 # helper function that strips tail from element and returns tail
 def strip_and_save_tail(element):
@@ -39,18 +44,40 @@ class Homework(Base):
     due_date = Column(DateTime)
     category_id = Column(Integer, ForeignKey('categories.id'))
     max_score = Column(Integer)
+    top_score = Column(Float) # highest score in the class, kept up to date by grading.py
 
     questions = relationship("Question", order_by="Question.id", backref="hw")
     category = relationship("Category")
 
+    @property
+    def default_max_score(self):
+        """The maximum score, which defaults to the highest score in the class"""
+        return self.max_score if self.max_score is not None else self.top_score
+
     def update_from_xml(self, xml):
-        node = ET.fromstring(xml)
-        for i, q in enumerate(node.iter('question')):
-            q_object = Question.from_xml(q)
-            q_object.homework = self
-            self.questions.append(q_object)
+        """Adds the questions in the XML, all in one transaction (see xml_import.py)"""
+        from xml_import import import_homework
+        import_homework(self, xml)
 
-        session.commit()
+    def load_responses(self, user):
+        """
+        Loads the user's responses to every question in this homework,
+        using a fixed number of queries regardless of the number of questions.
+        Returns a dict mapping question id to the output of `load_response`.
+        """
+        from queries import get_homework_questions, get_last_question_responses, get_tasks_for_grader
+        questions = get_homework_questions(self.id)
+        # peer reviews load the tasks for the question they review
+        reviewed_ids = []
+        for q in questions:
+            if isinstance(q, PeerReview):
+                q.set_metadata()
+                reviewed_ids.append(q.question_id)
+        prefetched = {
+            "responses": get_last_question_responses([q.id for q in questions], user.stuid),
+            "tasks": get_tasks_for_grader(reviewed_ids, user.stuid),
+            }
+        return dict((q.id, q.load_response(user, prefetched)) for q in questions)
 
 class Question(Base):
     __tablename__ = 'questions'
@@ -88,6 +115,7 @@ class Question(Base):
         return question
 
     def sync_from_node(self, node):
+        self.invalidate_html()
         node.attrib['id'] = str(self.id)
         # question properties
         self.name = node.attrib['name'] if 'name' in node.attrib else ""
@@ -108,7 +136,20 @@ class Question(Base):
         self.xml = ET.tostring(node, method="xml")
 
 
+    def invalidate_html(self):
+        """Drops any cached HTML for this question"""
+        render_cache.invalidate(lambda key: key[0] == self.id)
+
     def to_html(self, include_items=True):
+        key = (self.id, include_items,
+               content_hash(self.xml, *[item.xml for item in self.items]))
+        html = render_cache.get(key)
+        if html is None:
+            html = self.render_html(include_items)
+            render_cache.put(key, html)
+        return html
+
+    def render_html(self, include_items=True):
 
         node = ET.fromstring(self.xml)
         parent_map = dict((c, p) for p in node.iter() for c in p)
@@ -143,18 +184,31 @@ class Question(Base):
         if submission is None or submission.score is None:
             return submission
         due_date = submission.question.homework.due_date
-        submission.item_responses # instantiate item responses before we detach object from session
-        make_transient(submission) # detaches SQLAlchemy object from session
         now = pdt_now()
         time_available = min(submission.time + timedelta(minutes=30), due_date)
         if now < time_available:
-            submission.score = None
+            # show a copy, so that the stored score is never touched
+            submission = QuestionResponse(
+                id=submission.id,
+                stuid=submission.stuid,
+                question_id=submission.question_id,
+                time=submission.time,
+                sample=submission.sample,
+                item_responses=[ItemResponse(id=r.id,
+                                             question_response_id=r.question_response_id,
+                                             item_id=r.item_id,
+                                             response=r.response)
+                                for r in submission.item_responses],
+                score=None)
             submission.comments = '''Feedback on your submission will be available in %s minutes, at %s. Please refresh the page at that time to view it.''' % (1 + (time_available - now).seconds // 60, time_available.strftime("%H:%M"))
         return submission
 
-    def load_response(self, user):
-        from queries import get_last_question_response
-        last_submission = get_last_question_response(self.id, user.stuid)
+    def load_response(self, user, prefetched=None):
+        if prefetched is None:
+            from queries import get_last_question_response
+            last_submission = get_last_question_response(self.id, user.stuid)
+        else:
+            last_submission = prefetched["responses"].get(self.id)
         out = {
             'submission': self.delay_feedback(last_submission),
             'locked': self.check_if_locked(last_submission),
@@ -165,6 +219,7 @@ class Question(Base):
 
     def submit_response(self, stuid, responses):
         from queries import get_last_question_response
+        from grading import mark_dirty
         last_submission = get_last_question_response(self.id, stuid)
         if not self.check_if_locked(last_submission):
             item_responses = [ItemResponse(item_id=item.id, response=response) \
@@ -179,6 +234,7 @@ class Question(Base):
                 comments=comments
                 )
             session.add(question_response)
+            mark_dirty(stuid, self.hw_id)
             session.commit()
             return {
                 'submission': self.delay_feedback(question_response),
@@ -239,6 +295,15 @@ class Item(Base):
 
     def check(self, response):
         return None, ""
+
+    def compile_grader(self):
+        """
+        Abstract method.
+
+        Returns an object with a `check(response)` method that grades
+        responses without touching the XML. See `graders.get_grader`.
+        """
+        raise NotImplementedError
        
     def sync_from_node(self, node):
         """
@@ -284,24 +349,21 @@ class MultipleChoiceItem(Item):
                   "itemtype": "multiple-choice"}
         root = ET.Element("div", attrib=attrib)
         for i, option in enumerate(self.options):
-            node = ET.fromstring(r'''
-<p><input type='radio' name='%d' value='%d' disabled='disabled'></input></p>
-''' % (self.id, i))
-            node[0].text = " " + str(option)
-            root.append(node)
+            node = ET.SubElement(root, "p")
+            radio = ET.SubElement(node, "input", attrib={"type": "radio",
+                                                         "name": str(self.id),
+                                                         "value": str(i),
+                                                         "disabled": "disabled"})
+            radio.text = " " + str(option)
 
         return root
 
-    def check(self, response):
-
-        # parse the answers from the XML
+    def compile_grader(self):
         self.sync_from_node(ET.fromstring(self.xml))
+        return MultipleChoiceGrader(self.options)
 
-        try:
-            option = self.options[int(response)]
-            return option.points, option.comment
-        except:
-            raise Exception("Invalid multiple choice answer.")
+    def check(self, response):
+        return get_grader(self).check(response)
 
 class Option:
     points = None
@@ -349,16 +411,12 @@ class ShortAnswerItem(Item):
 
         return ET.Element("input", attrib=attrib)
 
-    def check(self, response):
-
-        # parse the answers from the XML
+    def compile_grader(self):
         self.sync_from_node(ET.fromstring(self.xml))
+        return ShortAnswerGrader(self.answers)
 
-        # check the answer
-        for answer in self.answers:
-            if answer.is_correct(response):
-                return answer.points, answer.comment
-        return 0, ""
+    def check(self, response):
+        return get_grader(self).check(response)
 
 class ShortAnswer(object):
 
@@ -381,61 +439,7 @@ class ShortAnswer(object):
             self.exact = data.strip().lower()
         else:
             raise NotImplementedError("ShortAnswer type=%s is not implemented"
-                                      % self.type)        
-
-    @staticmethod
-    def validate(expr):
-        if expr.count("(") != expr.count(")"):
-            raise Exception("You have mismatched parentheses (...) in your expression.")
-        allowed_chars = [str(n) for n in range(10)]
-        allowed_chars.extend([".", "+", "-", "*", "/", "(", ")"])
-        diff = set(expr)-set(allowed_chars)
-        if diff:
-            non_ascii = [c for c in diff if ord(c)>=128]
-            if non_ascii:
-                raise Exception('''The character %s is not an ASCII character. Perhaps you copied and pasted from Microsoft Word, or have confused it with a similar character?''' % non_ascii[0])
-            else:
-                raise Exception("You have the following illegal characters in your expression: %s" % ", ".join(diff))
-        return True
-
-    @staticmethod
-    def preprocess(expr):
-        # remove all whitespace
-        expr = "".join(expr.split())
-        # replace x with *
-        expr = expr.replace("x", "*")
-        # replace ^ with **
-        expr = expr.replace("^", "**")
-        # convert parentheses to explicit multiplications
-        expr = expr.replace(")(", ")*(")
-        for i in range(10):
-            expr = expr.replace("%d(" % i, "%d*(" % i)
-        return expr
-
-    def is_correct(self, response):
-        if self.type == "range":
-            response = "".join([c for c in response if c in '1234567890.-'])
-            try:
-                num_response = float(response)
-            except ValueError:
-                raise Exception("I didn't understand your response. Please try again.")
-            return self.lb - 1e-10 <= num_response <= self.ub + 1e-10
-        elif self.type == "exact":
-            str_response = response.strip().lower()
-            return str_response == self.exact
-        elif self.type == "expression":
-            if response:
-                processed_response = self.preprocess(response)
-                self.validate(processed_response)
-                ans = eval(self.preprocess(self.exact), {"__builtins__": None})
-                try:
-                    resp = eval(processed_response, {"__builtins__": None})
-                except:
-                    raise Exception("I'm sorry, but I did not understand the expression you typed in. Please check the expression and try again.")
-                return abs(resp - ans) < 1e-15
-        else:
-            raise Exception("Answer type not supported.")
-        return False
+                                      % self.type)
 
 class LongAnswerItem(Item):
     __mapper_args__ = {'polymorphic_identity': 'Long Answer'}
@@ -464,7 +468,8 @@ class LongAnswerItem(Item):
         form = ET.SubElement(frame, "form", attrib={"id": "long%s" % self.id, "action": "upload", "target": "target%s" % self.id, 
                                                     "method": "POST", "enctype": "multipart/form-data", 
                                                     "style": "width:0px;height:0;overflow:hidden"})
-        ET.SubElement(form, "input", attrib={"type": "file", "name": "file", "onchange": "$(this).parent('form').submit();this.value='';"})
+        # uploaded by LongAnswerItem.upload_file in longansweritem.js
+        ET.SubElement(form, "input", attrib={"type": "file", "name": "file"})
         
         return frame
 
@@ -476,6 +481,8 @@ class User(Base):
     type = Column(String(10))
     proxy = Column(String(10)) # allows admin to be a proxy for another user
 
+    __table_args__ = (Index('ix_users_type', 'type'),)
+
 
 class QuestionResponse(Base):
     __tablename__ = 'question_responses'
@@ -493,6 +500,8 @@ class QuestionResponse(Base):
 
     user = relationship("User")
 
+    __table_args__ = (Index('ix_question_responses_latest', 'stuid', 'question_id', 'time'),)
+
     def __str__(self):
         return "\n\n".join(ir.response for ir in self.item_responses)
 
@@ -507,6 +516,9 @@ class ItemResponse(Base):
     question_response = relationship("QuestionResponse")
     item_response = relationship("Item")    
 
+    # loading the items of many responses at once joins on this
+    __table_args__ = (Index('ix_item_responses_question_response', 'question_response_id'),)
+
 
 class GradingTask(Base):
     __tablename__ = 'grading_tasks'
@@ -522,7 +534,9 @@ class GradingTask(Base):
     question = relationship("Question")
 
     __table_args__ = (UniqueConstraint('grader', 'student', 'question_id', 
-                                       name='unique_task'),)
+                                       name='unique_task'),
+                      Index('ix_grading_tasks_grader', 'question_id', 'grader'),
+                      Index('ix_grading_tasks_student', 'question_id', 'student'))
 
 
 class PeerReview(Question):
@@ -530,9 +544,15 @@ class PeerReview(Question):
 
     def set_metadata(self):
         node = ET.fromstring(self.xml)
-        self.sync_from_node(node)
+        self.read_metadata(node)
 
     def sync_from_node(self, node):
+        self.read_metadata(node)
+        self.points = sum(self.peer_pts) + (self.self_pts or 0.) + self.rate_pts
+        self.xml = ET.tostring(node, method="xml")
+
+    def read_metadata(self, node):
+        """Reads the peer review settings from XML, without changing any columns"""
         self.question_id = int(node.attrib['question_id'])
         self.peer_pts = []
         for e in node.iter("peer"):
@@ -541,13 +561,11 @@ class PeerReview(Question):
         self.self_pts = float(sub.attrib['points']) if sub is not None else None
         sub = node.find("rate")
         self.rate_pts = float(sub.attrib['points']) if sub is not None else 0.
-        self.points = sum(self.peer_pts) + (self.self_pts or 0.) + self.rate_pts
-        self.xml = ET.tostring(node, method="xml")
 
     def to_html(self):
 
         # not good to have imports here...
-        from queries import get_question, get_last_question_response, get_peer_tasks_for_grader, get_self_tasks_for_student 
+        from queries import get_question, get_last_question_response, get_peer_tasks_for_grader
         from auth import validate_user
         self.set_metadata()
         user = validate_user()
@@ -563,27 +581,25 @@ class PeerReview(Question):
 
         # if self assessment was assigned
         if self.self_pts is not None:
-            # add the task if it hasn't been already
-            response = get_last_question_response(self.question_id, user.stuid)
-            if response and not get_self_tasks_for_student(self.question_id, user.stuid):
-                session.add(GradingTask(grader=user.stuid, 
-                                        student=user.stuid, 
-                                        question_id=self.question_id))
-                session.commit()
-            vars['self_response'] = response
-
-        # jinja2 to get template for peer review questions
-        from jinja2 import Environment, PackageLoader
-        env = Environment(autoescape=True, loader=PackageLoader("ohms", "templates"))
-        template = env.get_template("peer_review_question.html")
+            vars['self_response'] = get_last_question_response(self.question_id, user.stuid)
 
-        return template.render(**vars)
+        # rendered with the app's template environment, which caches compiled templates
+        from flask import render_template
+        return render_template("peer_review_question.html", **vars)
 
-    def load_response(self, user):
+    def load_response(self, user, prefetched=None):
 
         from queries import get_peer_tasks_for_grader, get_self_tasks_for_student
         self.set_metadata()
 
+        if prefetched is not None:
+            tasks = [t for t in prefetched["tasks"] if t.question_id == self.question_id]
+            peer_tasks = [t for t in tasks if t.student != user.stuid]
+            self_tasks = [t for t in tasks if t.student == user.stuid]
+        else:
+            peer_tasks = get_peer_tasks_for_grader(self.question_id, user.stuid) if len(self.peer_pts) else []
+            self_tasks = get_self_tasks_for_student(self.question_id, user.stuid) if self.self_pts is not None else []
+
         item_responses = []
         score = 0.
         time = None
@@ -591,7 +607,7 @@ class PeerReview(Question):
 
         # get peer tasks
         if len(self.peer_pts):
-            tasks = get_peer_tasks_for_grader(self.question_id, user.stuid)
+            tasks = peer_tasks
             ratings = []
             for i, task in enumerate(tasks):
                 # each review is a score + response; we represent each review as two items
@@ -617,7 +633,7 @@ class PeerReview(Question):
         # get self tasks
         if self.self_pts is not None:
             # there should really only be one task, but....
-            tasks = get_self_tasks_for_student(self.question_id, user.stuid)
+            tasks = self_tasks
             if tasks:
                 item_responses.extend([ItemResponse(response=tasks[0].score), ItemResponse(response=tasks[0].comments)])
                 if tasks[0].comments is not None: score += self.self_pts
@@ -636,6 +652,7 @@ class PeerReview(Question):
     def submit_response(self, stuid, responses):
 
         from queries import get_peer_tasks_for_grader, get_self_tasks_for_student
+        from grading import mark_dirty
         self.set_metadata()
 
         if pdt_now() <= self.homework.due_date:
@@ -654,6 +671,8 @@ class PeerReview(Question):
                 task.time = pdt_now()
                 task.score = responses[2*i]
                 task.comments = responses[2*i+1]
+                # the score counts towards the reviewed student's grade
+                mark_dirty(task.student, self.hw_id)
 
                 return task
 
@@ -674,6 +693,8 @@ class PeerReview(Question):
                     task = check_and_update_task(tasks[0])
                     if task.comments is not None: score += self.self_pts
 
+            mark_dirty(stuid, self.hw_id)
+
             comments = "Watch this space for your peers' judgment of your feedback. "
             if self.rate_pts:
                 comments += "Your peers' judgment is worth %f points, so you cannot earn all %s points yet." % (self.rate_pts, self.points)
@@ -705,5 +726,53 @@ class Grade(Base):
     homework = relationship("Homework")
     student = relationship("User")
 
-    __table_args__ = (UniqueConstraint('stuid', 'hw_id', name='unique_grade'),)
+    __table_args__ = (UniqueConstraint('stuid', 'hw_id', name='unique_grade'),
+                      Index('ix_grades_hw_id', 'hw_id'))
+
+
+
+class DirtyGrade(Base):
+    """A (student, homework) grade that needs to be recomputed"""
+    __tablename__ = 'dirty_grades'
+
+    id = Column(Integer, primary_key=True)
+    stuid = Column(String(10), ForeignKey('users.stuid'))
+    hw_id = Column(Integer, ForeignKey('hws.id'))
+
+    homework = relationship("Homework")
+    student = relationship("User")
+
+    __table_args__ = (UniqueConstraint('stuid', 'hw_id', name='unique_dirty_grade'),)
+
+
+class PeerAssignment(Base):
+    """Records that the grading tasks for a peer reviewed question have been assigned"""
+    __tablename__ = 'peer_assignments'
 
+    # the primary key doubles as a lock, so each question is assigned only once
+    question_id = Column(Integer, ForeignKey('questions.id'), primary_key=True)
+    time = Column(DateTime)
+    tasks = Column(Integer)
+
+    question = relationship("Question")
+
+
+class OutboxMessage(Base):
+    """An e-mail waiting to be sent by the worker in send_email.py"""
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True)
+    sender = Column(String(100))
+    recipient = Column(String(100))
+    name = Column(String(100))
+    subject = Column(String(200))
+    body = Column(UnicodeText)
+    created = Column(DateTime)
+    status = Column(String(10))   # pending, sending, sent or failed
+    attempts = Column(Integer)
+    next_attempt = Column(DateTime)
+    sent = Column(DateTime)
+    error = Column(UnicodeText)
+
+    __table_args__ = (Index('ix_outbox_status', 'status', 'next_attempt'),
+                      Index('ix_outbox_sent', 'sent'))
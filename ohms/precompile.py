@@ -0,0 +1,29 @@
+"""
+precompile.py
+
+Compiles every template into the template cache (options.template_cache_dir),
+so that after a deploy no request has to compile a template itself. setup.py
+and deploy.py run this from the deployed ohms directory, since cached
+templates are keyed by their path:
+
+    python precompile.py
+"""
+
+from app import app
+
+
+def precompile():
+    """Clears the template cache and compiles every template into it, returns their names"""
+    env = app.jinja_env
+    if env.bytecode_cache is None:
+        raise Exception("The template cache is turned off, or its directory cannot be written.")
+    env.bytecode_cache.clear()
+    names = env.list_templates(extensions=["html"])
+    for name in names:
+        env.get_template(name)
+    return names
+
+
+if __name__ == "__main__":
+    names = precompile()
+    print "Compiled %d templates into %s." % (len(names), app.jinja_env.bytecode_cache.directory)
@@ -0,0 +1,157 @@
+"""
+profiling.py
+
+Per-request profiling, turned on by `profile_requests` in options.py.
+
+For each request it records the number of SQL queries, the time spent in
+them, the slowest one (as a fingerprint, with the values taken out), the
+time spent rendering templates and the total time. These are sent back in
+a Server-Timing header, which the browser's developer tools show with the
+request, and the last `profile_buffer_size` requests are kept in memory
+and listed on the admin page. Each server process keeps its own list.
+
+Streamed responses (the CSV downloads) are timed up to the point where
+they start sending, so their header leaves out the queries made while
+streaming; the admin page still counts them.
+"""
+
+import re
+import time
+import threading
+from collections import deque
+
+from flask import request
+from flask.templating import Environment
+from jinja2 import Template
+from sqlalchemy import event
+
+import options
+from pdt import pdt_now
+
+# the profile of the request being handled by this thread, if any
+current = threading.local()
+
+recent_profiles = deque(maxlen=options.profile_buffer_size)
+recent_lock = threading.Lock()
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+VALUES = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+SPACE = re.compile(r"\s+")
+
+def fingerprint(statement):
+    """Returns the statement with its values and whitespace normalized, so that similar queries match"""
+    statement = STRING.sub("?", statement)
+    statement = NUMBER.sub("?", statement)
+    statement = VALUES.sub("(...)", statement)
+    return SPACE.sub(" ", statement).strip()
+
+
+class RequestProfile(object):
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.time = pdt_now()
+        self.start = time.time()
+        self.status = None
+        self.total = None
+        self.queries = 0
+        self.sql_time = 0.
+        self.slowest_time = 0.
+        self.slowest_statement = None
+        self.template_time = 0.
+        self.templates = []
+        self.rendering = 0
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.sql_time += seconds
+        if seconds >= self.slowest_time:
+            self.slowest_time = seconds
+            self.slowest_statement = statement
+
+    @property
+    def slowest_fingerprint(self):
+        if self.slowest_statement is None:
+            return ""
+        return fingerprint(self.slowest_statement)
+
+    def finish(self, status):
+        self.status = status
+        self.total = time.time() - self.start
+
+    def server_timing(self):
+        return ", ".join([
+            'sql;dur=%.1f;desc="%d queries"' % (1000 * self.sql_time, self.queries),
+            'sql-slowest;dur=%.1f' % (1000 * self.slowest_time),
+            'template;dur=%.1f;desc="%s"' % (1000 * self.template_time, " ".join(self.templates)),
+            'total;dur=%.1f' % (1000 * self.total),
+        ])
+
+
+class ProfiledTemplate(Template):
+    """A template that adds the time spent rendering it to the current request's profile"""
+
+    def render(self, *args, **kwargs):
+        profile = getattr(current, "profile", None)
+        if profile is None:
+            return Template.render(self, *args, **kwargs)
+        # templates rendered inside other templates (peer review questions)
+        # are already counted in the outer template's time
+        profile.rendering += 1
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            profile.rendering -= 1
+            profile.templates.append(self.name or "<string>")
+            if not profile.rendering:
+                profile.template_time += time.time() - start
+
+class ProfiledEnvironment(Environment):
+    template_class = ProfiledTemplate
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.time())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    profile = getattr(current, "profile", None)
+    if profile is not None:
+        profile.add_query(statement, time.time() - start)
+
+def start_profile():
+    current.profile = RequestProfile(request.method, request.full_path.rstrip("?"))
+
+def finish_profile(response):
+    profile = getattr(current, "profile", None)
+    if profile is None:
+        return response
+    profile.finish(response.status_code)
+    response.headers["Server-Timing"] = profile.server_timing()
+    with recent_lock:
+        recent_profiles.append(profile)
+    return response
+
+def stop_profile(exception=None):
+    current.profile = None
+
+def recent():
+    """Returns the profiles of the most recent requests, newest first"""
+    with recent_lock:
+        return list(reversed(recent_profiles))
+
+def install_profiler(app):
+    """
+    Profiles every request to the app. Must be called before the app
+    renders its first template, which creates its template environment.
+    """
+    from base import engine
+    app.jinja_environment = ProfiledEnvironment
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(stop_profile)
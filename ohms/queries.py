@@ -4,6 +4,8 @@ queries.py
 Some useful sql queries.
 """
 
+from sqlalchemy import func, and_, text
+from sqlalchemy.orm import subqueryload, contains_eager
 from base import session
 from objects import QuestionResponse, GradingTask, User, \
     Homework, Question, PeerReview, Grade
@@ -31,12 +33,20 @@ def get_homework(hw_id=None):
     else:
         return session.query(Homework).get(hw_id)
 
-def get_homeworks_before(due_date=pdt_now()):
+def get_homeworks_before(due_date=None):
+    if due_date is None:
+        due_date = pdt_now()
     return session.query(Homework).filter(Homework.due_date <= due_date).all()
     
 def get_question(question_id):
     return session.query(Question).get(question_id)
 
+def get_homework_questions(hw_id):
+    """Returns the questions in a homework, with their items already loaded"""
+    return session.query(Question).filter_by(hw_id=hw_id).\
+        options(subqueryload(Question.items)).\
+        order_by(Question.id).all()
+
 def get_all_regular_questions():
     return [q for q in session.query(Question).\
                 filter(Question.hw_id != None).\
@@ -56,17 +66,82 @@ def get_question_responses(question_id, stuid):
         order_by(QuestionResponse.time).all()
 
 def get_last_question_response(question_id, stuid):
-    qrs = get_question_responses(question_id, stuid)
-    return qrs[-1] if qrs else None
+    # walks the (stuid, question_id, time) index backwards and stops at the
+    # first row, so the cost doesn't grow with the number of resubmissions
+    return session.query(QuestionResponse).\
+        filter_by(stuid=stuid).\
+        filter_by(question_id=question_id).\
+        order_by(QuestionResponse.time.desc(), QuestionResponse.id.desc()).\
+        first()
+
+def get_last_question_responses(question_ids, stuid):
+    """
+    Returns a dict mapping question id to the student's last response to that
+    question, for all of the given questions at once.
+    """
+    if not question_ids:
+        return {}
+    last = session.query(QuestionResponse.question_id,
+                         func.max(QuestionResponse.time).label("time")).\
+        filter(QuestionResponse.stuid == stuid).\
+        filter(QuestionResponse.question_id.in_(question_ids)).\
+        group_by(QuestionResponse.question_id).subquery()
+    qrs = session.query(QuestionResponse).\
+        join(last, and_(QuestionResponse.question_id == last.c.question_id,
+                        QuestionResponse.time == last.c.time)).\
+        filter(QuestionResponse.stuid == stuid).\
+        options(subqueryload(QuestionResponse.item_responses)).\
+        order_by(QuestionResponse.id).all()
+    # if two responses share a timestamp, the later one wins
+    return dict((qr.question_id, qr) for qr in qrs)
 
 def get_all_responses_to_question(question_id):
-    users = session.query(User).filter_by(type="student").all()
-    responses = []
-    for u in users:
-        response = get_last_question_response(question_id, u.stuid)
-        if response:
-            responses.append(response)
-    return responses
+    """
+    Returns every student's last response to a question, in a single
+    query, with the item responses and users already loaded.
+    """
+    last = session.query(QuestionResponse.stuid,
+                         func.max(QuestionResponse.time).label("time")).\
+        filter(QuestionResponse.question_id == question_id).\
+        group_by(QuestionResponse.stuid).subquery()
+    qrs = session.query(QuestionResponse).\
+        join(last, and_(QuestionResponse.stuid == last.c.stuid,
+                        QuestionResponse.time == last.c.time)).\
+        join(QuestionResponse.user).\
+        filter(QuestionResponse.question_id == question_id).\
+        filter(User.type == "student").\
+        options(contains_eager(QuestionResponse.user),
+                subqueryload(QuestionResponse.item_responses)).\
+        order_by(QuestionResponse.stuid, QuestionResponse.id).all()
+    # if two responses share a timestamp, the later one wins
+    latest = dict((qr.stuid, qr) for qr in qrs)
+    return [latest[stuid] for stuid in sorted(latest)]
+
+def get_responders(question_ids):
+    """Returns a dict mapping question id to the set of students who responded"""
+    responders = dict((q_id, set()) for q_id in question_ids)
+    if question_ids:
+        # admins and guests who answered are not peer graded
+        rows = session.query(QuestionResponse.question_id, QuestionResponse.stuid).\
+            join(QuestionResponse.user).\
+            filter(QuestionResponse.question_id.in_(question_ids)).\
+            filter(User.type == "student").\
+            distinct().all()
+        for q_id, stuid in rows:
+            responders[q_id].add(stuid)
+    return responders
+
+def insert_ignore(table, rows, bind=None):
+    """
+    Inserts rows in one statement, skipping any that violate a unique
+    constraint, with the request's session or else `bind`
+    """
+    if not rows:
+        return
+    insert = table.insert().\
+        prefix_with("OR IGNORE", dialect="sqlite").\
+        prefix_with("IGNORE", dialect="mysql")
+    (bind or session).execute(insert, rows)
 
 def get_grading_task(grading_task_id):
     return session.query(GradingTask).get(grading_task_id)
@@ -89,6 +164,15 @@ def get_self_tasks_for_student(question_id, stuid):
         filter(GradingTask.student == stuid).\
         all()
 
+def get_tasks_for_grader(question_ids, stuid):
+    """Returns all peer and self tasks for a grader on the given questions"""
+    if not question_ids:
+        return []
+    return session.query(GradingTask).\
+        filter_by(grader=stuid).\
+        filter(GradingTask.question_id.in_(question_ids)).\
+        order_by(GradingTask.id).all()
+
 def get_peer_tasks_for_student(question_id, stuid):
     return session.query(GradingTask).\
         filter_by(student=stuid).join(Question).\
@@ -105,11 +189,38 @@ def get_grade(stuid, hw_id):
     return session.query(Grade).filter_by(stuid=stuid).\
         filter_by(hw_id=hw_id).first()
 
-def add_grade(student, homework, score, excused=False):
-    grade = Grade(student=student, homework=homework, 
-                  score=score, excused=excused)
-    session.add(grade)
-    session.commit()
+def get_homework_grades(hw_id):
+    return session.query(Grade).filter_by(hw_id=hw_id).all()
+
+def upsert_grade(stuid, hw_id, score, excused=None):
+    """
+    Sets a student's grade on a homework, creating the row if necessary,
+    in one statement, so that two concurrent refreshes cannot both insert.
+    `excused` is left as it is unless it is given.
+    """
+    grades = Grade.__table__
+    values = {"stuid": stuid, "hw_id": hw_id, "score": score, "excused": bool(excused)}
+    updated = ["score"] if excused is None else ["score", "excused"]
+    dialect = session.connection().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(grades).values(**values)
+        statement = statement.on_duplicate_key_update(
+            **dict((column, statement.inserted[column]) for column in updated))
+        session.execute(statement)
+    elif dialect == "sqlite":
+        # SQLAlchemy 1.3 has no construct for ON CONFLICT on SQLite
+        session.execute(text(
+            "INSERT INTO grades (stuid, hw_id, score, excused) "
+            "VALUES (:stuid, :hw_id, :score, :excused) "
+            "ON CONFLICT (stuid, hw_id) DO UPDATE SET " +
+            ", ".join("%s = excluded.%s" % (column, column) for column in updated)), values)
+    else:
+        result = session.execute(grades.update().
+            where(and_(grades.c.stuid == stuid, grades.c.hw_id == hw_id)).
+            values(**dict((column, values[column]) for column in updated)))
+        if result.rowcount == 0:
+            session.execute(grades.insert().values(**values))
     
 def get_user(stuid):
     return session.query(User).filter_by(stuid=stuid).one()
@@ -1,29 +1,253 @@
 """
-email.py
+send_email.py
 
 Tools for sending emails.
+
+E-mails are not sent during the web request. `send_all` adds them to the
+outbox table, and a worker sends them in batches over a small pool of
+SMTP connections, retrying failures with exponential backoff and staying
+under a per-minute rate limit. Several workers can run at once: each
+claims its batch before sending it (see claim_batch).
+
+    python send_email.py worker   # keep sending as e-mails are queued
+    python send_email.py flush    # send everything that can be sent now, then exit
+    python send_email.py          # show the state of the outbox
+
+To try it locally, run a stand-in mail server on the port in local_options:
+
+    python -m smtpd -n -c DebuggingServer localhost:1025
 """
 
 
 # XXX: This doesn't appear to work on corn, perhaps only works from the web
 # servers, because can't connect to localhost. Fuck an A, amiright?
 
+import sys
+import time
 import smtplib
+import Queue
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import func
+
+from base import session
+from objects import OutboxMessage
+from pdt import pdt_now
+import options
+
+SENDER = 'stats60-spr1314-staff@lists.stanford.edu'
+SENDER_NAME = 'Stats 60 Staff'
+
+# seconds to wait before retrying a failed e-mail, doubled after each attempt
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+# how long a worker has to send the e-mails it claimed, before another may
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
 
 def send_all(users, subject, message):
     """Message should have a '%s' for their name"""
 
-    smtpObj = smtplib.SMTP('localhost')
-    sender = 'stats60-spr1314-staff@lists.stanford.edu'
+    now = pdt_now()
+    rows = [{"sender": SENDER,
+             "recipient": "%s@stanford.edu" % user.stuid,
+             "name": user.name,
+             "subject": subject,
+             "body": message % user.name,
+             "created": now,
+             "status": "pending",
+             "attempts": 0,
+             "next_attempt": now} for user in users]
+    if rows:
+        session.execute(OutboxMessage.__table__.insert(), rows)
+    session.commit()
+    return len(rows)
+
+def format_message(m):
+    msg = u"\n".join([u"From: %s <%s>" % (SENDER_NAME, m.sender),
+                      u"To: %s <%s>" % (m.name, m.recipient),
+                      u"Subject: %s" % m.subject,
+                      u"",
+                      m.body])
+    return msg.encode("utf-8")
+
+
+class SMTPPool(object):
+    """
+    A fixed number of SMTP connections that are opened when first needed
+    and reused for every message after that.
+    """
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle = Queue.Queue()
+        for _ in range(size):
+            self.idle.put(None)
+
+    def connect(self):
+        return smtplib.SMTP(self.host, self.port)
+
+    def send(self, sender, recipient, msg):
+        """Sends one message, returning None or the error message if it failed"""
+        connection = self.idle.get()
+        try:
+            if connection is None:
+                connection = self.connect()
+            connection.sendmail(sender, [recipient], msg)
+            return None
+        except smtplib.SMTPRecipientsRefused as e:
+            # the connection is still good, only this recipient was refused
+            return str(e)
+        except (smtplib.SMTPException, IOError) as e:
+            # open a new connection for the next message
+            self.discard(connection)
+            connection = None
+            return str(e) or e.__class__.__name__
+        finally:
+            self.idle.put(connection)
+
+    def discard(self, connection):
+        if connection is None:
+            return
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, IOError):
+            connection.close()
+
+    def close(self):
+        for _ in range(self.size):
+            self.discard(self.idle.get())
+            self.idle.put(None)
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+def sent_in_last_minute():
+    since = pdt_now() - timedelta(minutes=1)
+    return session.query(func.count(OutboxMessage.id)).\
+        filter(OutboxMessage.sent >= since).scalar()
+
+def claim_batch(limit):
+    """
+    Claims up to `limit` e-mails that are due, so that no other worker
+    sends them too, and returns them. Each one is moved from pending to
+    sending by an UPDATE that only matches the row as it was read, so of
+    two workers that read the same row, only one gets it. A worker that
+    dies while sending leaves its e-mails to be claimed again after
+    CLAIM_TIMEOUT.
+    """
+    table = OutboxMessage.__table__
+    claimed = []
+    while not claimed:
+        now = pdt_now()
+        candidates = session.query(OutboxMessage.id, OutboxMessage.status,
+                                   OutboxMessage.next_attempt).\
+            filter(OutboxMessage.status.in_(["pending", "sending"])).\
+            filter(OutboxMessage.next_attempt <= now).\
+            order_by(OutboxMessage.id).limit(limit).all()
+        if not candidates:
+            return []
+        for id, status, next_attempt in candidates:
+            result = session.execute(table.update().
+                                     where(table.c.id == id).
+                                     where(table.c.status == status).
+                                     where(table.c.next_attempt == next_attempt).
+                                     values(status="sending", next_attempt=now + CLAIM_TIMEOUT))
+            if result.rowcount == 1:
+                claimed.append(id)
+        # if another worker took all of them, read the next ones
+        session.commit()
+    return session.query(OutboxMessage).filter(OutboxMessage.id.in_(claimed)).\
+        order_by(OutboxMessage.id).all()
+
+def send_batch(pool):
+    """
+    Sends the next batch of pending e-mails that are due, without going
+    over the rate limit. Returns the number of e-mails attempted.
+    """
+    limit = min(options.email_batch_size, options.email_rate_limit - sent_in_last_minute())
+    if limit <= 0:
+        return 0
+    batch = claim_batch(limit)
+    if not batch:
+        return 0
+
+    threads = ThreadPool(pool.size)
+    try:
+        errors = threads.map(lambda m: pool.send(m.sender, m.recipient, format_message(m)), batch)
+    finally:
+        threads.close()
+
+    now = pdt_now()
+    for m, error in zip(batch, errors):
+        m.attempts += 1
+        if error is None:
+            m.status = "sent"
+            m.sent = now
+            m.error = None
+        else:
+            m.error = error.decode("utf-8", "replace")
+            if m.attempts >= options.email_max_attempts:
+                m.status = "failed"
+            else:
+                m.status = "pending"
+                m.next_attempt = now + retry_delay(m.attempts)
+    session.commit()
+    return len(batch)
+
+def next_wakeup():
+    """Returns the number of seconds until the next pending e-mail is due"""
+    due = session.query(func.min(OutboxMessage.next_attempt)).\
+        filter(OutboxMessage.status.in_(["pending", "sending"])).scalar()
+    if due is None:
+        return None
+    return max((due - pdt_now()).total_seconds(), 0)
+
+def flush(pool):
+    """Sends batches until nothing more can be sent right now"""
+    total = 0
+    while True:
+        n = send_batch(pool)
+        if not n:
+            return total
+        total += n
+
+def run_worker(poll=10):
+    """Sends e-mails as they are queued, checking every `poll` seconds"""
+    pool = SMTPPool(options.smtp_host, options.smtp_port, options.smtp_connections)
+    try:
+        while True:
+            n = flush(pool)
+            if n:
+                print "Attempted %d e-mails." % n
+            # stay idle until the next retry or rate limit window, or new mail
+            wait = next_wakeup()
+            session.close()
+            time.sleep(poll if wait is None else min(max(wait, 1), poll))
+    finally:
+        pool.close()
+
+def outbox_status():
+    return session.query(OutboxMessage.status, func.count(OutboxMessage.id)).\
+        group_by(OutboxMessage.status).all()
 
-    for user in users:
-        name = user.name
-        email = "%s@stanford.edu" % user.stuid
-        
-        msg = "\n".join(["From: Stats 60 Staff <%s>" % sender,
-                         "To: %s <%s>" % (name, email),
-                         "Subject: %s" % subject,
-                         "",
-                         message % name])
 
-        smtpObj.sendmail(sender, [email], msg)
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "worker":
+        run_worker()
+    elif command == "flush":
+        pool = SMTPPool(options.smtp_host, options.smtp_port, options.smtp_connections)
+        try:
+            print "Attempted %d e-mails." % flush(pool)
+        finally:
+            pool.close()
+    elif command == "status":
+        for status, count in outbox_status():
+            print "%s: %d" % (status, count)
+    else:
+        print "The command is: python send_email.py (status/flush/worker)"
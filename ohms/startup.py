@@ -0,0 +1,107 @@
+"""
+startup.py
+
+Measures the start-up cost of a CGI request.
+
+Under cgi-bin/index.cgi every request pays for importing the app, so this
+reports how long each module takes to import (its own time, not counting
+the modules it imports) and how long the first request to a page takes,
+and checks the total against `startup_budget_ms` in options.py:
+
+    python startup.py [path]       # defaults to /list
+
+It exits with status 1 when the budget is exceeded. The profiler adds
+some overhead to each import, so the total is timed again in a new
+process without it.
+"""
+
+import sys
+import time
+import __builtin__
+
+import options
+
+
+class ImportProfiler(object):
+    """Wraps __import__ to record the time spent importing each new module"""
+
+    def __init__(self):
+        self.times = {}
+        self.stack = []
+        self.original = None
+
+    def __enter__(self):
+        self.original = __builtin__.__import__
+        __builtin__.__import__ = self.timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        __builtin__.__import__ = self.original
+
+    def timed_import(self, name, *args, **kwargs):
+        before = set(sys.modules)
+        self.stack.append(0.)
+        start = time.time()
+        try:
+            return self.original(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            # only count imports that actually loaded something
+            loaded = [m for m in sys.modules if m not in before and sys.modules[m] is not None]
+            if loaded:
+                module = module_name(name, loaded)
+                own, total = self.times.get(module, (0., 0.))
+                self.times[module] = (own + elapsed - children, total + elapsed)
+
+def module_name(name, loaded):
+    """Returns the full name of the module that `import name` loaded"""
+    matches = [m for m in loaded if name and (m == name or m.endswith("." + name))]
+    return min(matches or loaded, key=len)
+
+def time_startup(path, profiler=None):
+    """Returns (seconds to import the app, seconds for the first request to path)"""
+    start = time.time()
+    if profiler is not None:
+        with profiler:
+            from app import app
+    else:
+        from app import app
+    imported = time.time() - start
+
+    start = time.time()
+    app.test_client().get(path).get_data()
+    return imported, time.time() - start
+
+def time_fresh_startup(path):
+    """Times the start-up in a new process, without the profiler's overhead"""
+    import subprocess
+    out = subprocess.check_output([sys.executable, __file__, "--time", path])
+    imported, first_request = out.split()
+    return float(imported), float(first_request)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args and args[0] == "--time":
+        print "%f %f" % time_startup(args[1])
+        sys.exit(0)
+    path = args[0] if args else "/list"
+
+    profiler = ImportProfiler()
+    time_startup(path, profiler)
+    print "%-40s %10s %10s" % ("module", "self ms", "total ms")
+    for name, (own, total) in sorted(profiler.times.items(), key=lambda t: -t[1][0])[:30]:
+        print "%-40s %10.1f %10.1f" % (name, 1000 * own, 1000 * total)
+
+    imported, first_request = time_fresh_startup(path)
+    total = imported + first_request
+    print
+    print "%-30s %8.1f ms" % ("import app", 1000 * imported)
+    print "%-30s %8.1f ms" % ("first request to " + path, 1000 * first_request)
+    print "%-30s %8.1f ms (budget %d ms)" % ("total", 1000 * total, options.startup_budget_ms)
+    if 1000 * total > options.startup_budget_ms:
+        print "Over budget!"
+        sys.exit(1)
@@ -0,0 +1,234 @@
+"""
+synthetic.py
+
+Generates a synthetic course, for benchmarks and for trying out changes
+on realistic amounts of data.
+
+The course has `students` students, and `homeworks` homeworks split
+between two categories. Each homework has Multiple Choice, Short Answer
+and Long Answer questions, and from the second homework on, a peer review
+of the previous homework's Long Answer question. Most students answer
+most questions, some more than once. Homeworks in the past are due, have
+their grading tasks assigned and mostly completed, and have their grades
+computed; the last quarter of the homeworks are still open.
+
+This REPLACES everything in the database, so it only runs on SQLite;
+point get_db() in options.py at a scratch file first:
+
+    python synthetic.py [students] [homeworks]
+"""
+
+import sys
+import random
+import time
+from datetime import timedelta
+
+from base import Base, engine, session
+from objects import User, Category, Homework, Question, PeerReview, LongAnswerItem, \
+    QuestionResponse, ItemResponse, GradingTask
+from pdt import pdt_now
+
+FIRST_NAMES = ["Alice", "Bob", "Carol", "David", "Erin", "Frank", "Grace", "Heidi",
+               "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil"]
+LAST_NAMES = ["Anderson", "Brown", "Chen", "Diaz", "Evans", "Garcia", "Kim", "Lee",
+              "Martin", "Nguyen", "Patel", "Smith", "Tanaka", "Wong"]
+
+QUESTION_XML = u"""
+<question name="Question %(n)d.1">
+  A fair coin is tossed %(tosses)d times. Which is more likely?
+  <item type="Multiple Choice" points="1">
+    <option correct="true">Neither, they are equally likely</option>
+    <option>Getting more heads than tails</option>
+    <option>Getting more tails than heads</option>
+  </item>
+  What is the chance of getting more heads than tails?
+  <item type="Short Answer" points="2">
+    <answer type="range">[%(low)s, %(high)s]</answer>
+  </item>
+</question>
+<question name="Question %(n)d.2">
+  What is the probability of rolling a six in %(rolls)d rolls of a die?
+  <item type="Short Answer" points="2">
+    <answer type="expression">1 - (5/6)^%(rolls)d</answer>
+  </item>
+  <item type="Multiple Choice" points="1">
+    <option>Less than 1/2</option>
+    <option correct="true">At least 1/2</option>
+  </item>
+</question>
+<question name="Question %(n)d.3">
+  Describe a study that could show whether the new treatment works.
+  <item type="Long Answer" points="6">
+    <solution>A randomized controlled experiment, ideally double-blind.</solution>
+  </item>
+</question>
+"""
+
+PEER_REVIEW_XML = u"""
+<question name="Peer Review %(n)d" review="true" question_id="%(question_id)d">
+  <peer points="1"/>
+  <peer points="1"/>
+  <peer points="1"/>
+  <self points="1"/>
+  <rate points="1"/>
+</question>
+"""
+
+COMMENTS = [u"Clear and well argued.",
+            u"Good idea, but it needs a control group.",
+            u"This does not answer the question.",
+            u"Nice, although the explanation could be shorter."]
+
+
+def clear_database():
+    """Drops and recreates every table; refuses anything but SQLite"""
+    if engine.dialect.name != "sqlite":
+        raise Exception("synthetic.py replaces the whole database, so it only runs on SQLite.")
+    from migrations import upgrade
+    session.remove()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    upgrade()
+
+def add_users(students):
+    users = [User(stuid="test", name="Test User", type="admin")]
+    for i in range(students):
+        users.append(User(stuid="stu%05d" % i,
+                          name="%s %s" % (random.choice(FIRST_NAMES), random.choice(LAST_NAMES)),
+                          type="student"))
+    session.add_all(users)
+    session.commit()
+    return [u.stuid for u in users if u.type == "student"]
+
+def add_homeworks(homeworks):
+    """Adds the homeworks, one a week, of which the last quarter are not yet due"""
+    categories = [Category(name="Homework", weight=70, drops=1),
+                  Category(name="Quiz", weight=30, drops=0)]
+    session.add_all(categories)
+    now = pdt_now()
+    open_homeworks = max(1, homeworks // 4)
+    long_answer = None
+    hws = []
+    for n in range(1, homeworks + 1):
+        due_date = now + timedelta(weeks=n - (homeworks - open_homeworks), hours=-1)
+        hw = Homework(name="Homework %d" % n,
+                      start_date=due_date - timedelta(weeks=1),
+                      due_date=due_date,
+                      category=categories[n % 3 == 0])
+        session.add(hw)
+        session.commit()
+        xml = QUESTION_XML % {"n": n, "tosses": 2 * n + 1, "low": 0.45, "high": 0.55,
+                              "rolls": n + 2}
+        if long_answer is not None:
+            xml += PEER_REVIEW_XML % {"n": n - 1, "question_id": long_answer}
+        hw.update_from_xml(u"<homework>%s</homework>" % xml)
+        long_answer = [q.id for q in hw.questions
+                       if q.items and isinstance(q.items[0], LongAnswerItem)][0]
+        hws.append(hw)
+    return hws
+
+def random_responses(question):
+    responses = []
+    for item in question.items:
+        if item.type == "Multiple Choice":
+            # favour the first option, as a class tends to agree
+            options = item.xml.count("<option")
+            responses.append(unicode(random.choice([0, 0] + range(options))))
+        elif item.type == "Short Answer":
+            responses.append(random.choice([u"0.5", u"1/2", u"0.9", u"0.7"]))
+        else:
+            responses.append(u"I would randomly assign %d people to two groups." %
+                             random.randint(10, 1000))
+    return responses
+
+def add_responses(hws, stuids, answer_rate=0.9, resubmit_rate=0.3):
+    """
+    Adds every student's responses, with several submissions for some of
+    them. The rows are inserted in bulk, so their ids are allocated here,
+    which is safe because the database has just been created.
+    """
+    question_rows, item_rows = [], []
+    question_response_id = item_response_id = 0
+    now = pdt_now()
+    for hw in hws:
+        for q in hw.questions:
+            if isinstance(q, PeerReview):
+                continue
+            for stuid in stuids:
+                if random.random() > answer_rate:
+                    continue
+                submissions = 1
+                while random.random() < resubmit_rate and submissions < 5:
+                    submissions += 1
+                for k in range(submissions):
+                    # submissions to open homeworks are in the past too
+                    latest = min(hw.due_date, now)
+                    submitted = latest - timedelta(hours=random.randint(1, 72), minutes=k)
+                    responses = random_responses(q)
+                    score, comments = q.check(responses)
+                    question_response_id += 1
+                    question_rows.append({"id": question_response_id, "stuid": stuid,
+                                          "question_id": q.id, "time": submitted,
+                                          "score": score, "comments": comments})
+                    for item, response in zip(q.items, responses):
+                        item_response_id += 1
+                        item_rows.append({"id": item_response_id,
+                                          "question_response_id": question_response_id,
+                                          "item_id": item.id, "response": response})
+    session.execute(QuestionResponse.__table__.insert(), question_rows)
+    session.execute(ItemResponse.__table__.insert(), item_rows)
+    session.commit()
+    return len(question_rows)
+
+def complete_tasks(hws, completion_rate=0.8):
+    """Assigns the grading tasks for past due homeworks, and fills most of them in"""
+    from assign_tasks import assign_tasks, assign_due_peer_reviews
+    now = pdt_now()
+    for hw in hws:
+        if hw.due_date <= now:
+            assign_tasks(hw.id, hw.due_date)
+    assign_due_peer_reviews()
+
+    tasks = session.query(GradingTask).all()
+    for task in tasks:
+        if random.random() > completion_rate:
+            continue
+        task.time = now - timedelta(hours=random.randint(1, 48))
+        task.score = random.randint(0, 6)
+        task.comments = random.choice(COMMENTS)
+        if random.random() < completion_rate:
+            task.rating = random.randint(1, 4)
+    session.commit()
+    return len(tasks)
+
+def generate_course(students=200, homeworks=8, seed=0):
+    """Replaces the database with a synthetic course, and returns how long each step took"""
+    from grading import mark_everything_dirty, refresh_grades
+    random.seed(seed)
+    timings = []
+    def step(name, f, *args):
+        start = time.time()
+        result = f(*args)
+        timings.append((name, result, time.time() - start))
+        return result
+
+    step("create tables", clear_database)
+    stuids = step("students", add_users, students)
+    hws = step("homeworks", add_homeworks, homeworks)
+    step("question responses", add_responses, hws, stuids)
+    step("grading tasks", complete_tasks, hws)
+    def grades():
+        mark_everything_dirty()
+        return refresh_grades()
+    step("grades", grades)
+    return timings
+
+
+if __name__ == "__main__":
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    homeworks = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    for name, result, seconds in generate_course(students, homeworks):
+        if isinstance(result, list):
+            result = len(result)
+        count = "" if result is None else " (%d)" % result
+        print "%-20s %8.2fs%s" % (name, seconds, count)
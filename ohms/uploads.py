@@ -0,0 +1,252 @@
+"""
+uploads.py
+
+Files that students attach to their answers, stored in WWW/<upload_dir>/.
+
+Each file is named after the SHA-1 hash of its contents, so the same file
+uploaded twice is stored once, at the same URL. Files are written to disk
+in chunks as they arrive, and hashed on the way, instead of being held in
+memory. Files over `upload_max_size`, or without one of the
+`upload_extensions`, are refused before any of their contents are read.
+
+A file can be uploaded in one request, as a multipart form to /upload,
+or in several, so that a large upload that fails part way can be resumed
+(the answer editor does this, see static/js/upload.js, and falls back to
+the form in browsers that cannot):
+
+    POST /upload/start        form fields filename and size; returns
+                              {"id": ..., "offset": 0}
+    PUT  /upload/<id>?offset=n
+                              the next bytes of the file, starting at n;
+                              returns {"offset": ...}, and the "url" once
+                              all of the file has been received
+    GET  /upload/<id>         returns {"offset": ...}, to find where to
+                              resume after a failure
+
+Errors are returned as {"error": message}, with the HTTP status, and a
+409 for bytes sent at the wrong offset also has the right "offset".
+
+Unfinished uploads are kept in WWW/<upload_dir>/.incoming/ until
+
+    python uploads.py clean
+
+removes the ones older than `upload_expiry_hours`.
+"""
+
+import os
+import sys
+import json
+import fcntl
+import time
+import hashlib
+import tempfile
+import binascii
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType, NotFound, \
+    Forbidden, Conflict, BadRequest
+
+import options
+
+CHUNK_SIZE = 64 * 1024
+
+
+def upload_dir():
+    return "%s/WWW/%s" % (options.base_dir, options.upload_dir)
+
+def incoming_dir():
+    """Files being received are kept here, on the same disk, so they can be renamed into place"""
+    path = os.path.join(upload_dir(), ".incoming")
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # another process made it first
+            if not os.path.isdir(path):
+                raise
+    return path
+
+def extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ""
+
+def check_upload(filename, size=None):
+    """Refuses files that are too big or of the wrong type, before reading them"""
+    if extension(filename) not in options.upload_extensions:
+        raise UnsupportedMediaType("Files of this type cannot be uploaded. Please upload one of: %s." %
+                                   ", ".join(options.upload_extensions))
+    if size is not None and size > options.upload_max_size:
+        raise RequestEntityTooLarge("Files cannot be larger than %g MB." %
+                                    (options.upload_max_size / (1024 * 1024.)))
+
+def file_url(filename):
+    return "%s/%s/%s" % (options.base_url, options.upload_dir, filename)
+
+def store(path, digest, ext):
+    """
+    Moves a received file into place under the name given by its hash,
+    unless the same file is already there. Returns the file's URL.
+    """
+    filename = "%s.%s" % (digest, ext)
+    final = os.path.join(upload_dir(), filename)
+    if os.path.exists(final):
+        os.remove(path)
+    else:
+        os.chmod(path, 0644)
+        os.rename(path, final)
+    return file_url(filename)
+
+
+class HashingFile(object):
+    """
+    A file in the incoming directory that hashes what is written to it,
+    and refuses to grow past upload_max_size. Werkzeug writes each file in
+    a form upload to one of these (see UploadRequest).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+        fd, self.path = tempfile.mkstemp(dir=incoming_dir(), suffix=".form")
+        self.file = os.fdopen(fd, "w+b")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > options.upload_max_size:
+            self.discard()
+            check_upload(self.filename, self.size)
+        self.sha1.update(data)
+        self.file.write(data)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        """Stores the file under its hash, and returns its URL"""
+        self.file.close()
+        return store(self.path, self.sha1.hexdigest(), extension(self.filename))
+
+    def __getattr__(self, name):
+        # read, seek and so on, which Werkzeug uses when it is done writing
+        return getattr(self.file, name)
+
+class UploadRequest(Request):
+    """Streams files uploaded to /upload straight to the incoming directory"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        if self.endpoint != "upload":
+            return Request._get_file_stream(self, total_content_length, content_type,
+                                            filename, content_length)
+        check_upload(filename, content_length or None)
+        return HashingFile(filename)
+
+def save_form_upload(request):
+    """Stores the file in a multipart /upload request, and returns its URL"""
+    # before Werkzeug reads any of the form
+    if request.content_length and request.content_length > options.upload_max_size + CHUNK_SIZE:
+        raise RequestEntityTooLarge("Files cannot be larger than %g MB." %
+                                    (options.upload_max_size / (1024 * 1024.)))
+    file = request.files.get('file')
+    if not file:
+        raise BadRequest("No file uploaded.")
+    return file.stream.save()
+
+
+def upload_paths(upload_id):
+    """Returns the paths of the data and the description of a resumable upload"""
+    if not upload_id.isalnum():
+        raise NotFound("There is no such upload.")
+    base = os.path.join(incoming_dir(), upload_id)
+    return base + ".part", base + ".json"
+
+def start_upload(stuid, filename, size):
+    """Starts a resumable upload, and returns its id"""
+    if size is None or size < 0:
+        raise BadRequest("The size of the file is missing.")
+    check_upload(filename, size)
+    upload_id = binascii.hexlify(os.urandom(16))
+    data_path, info_path = upload_paths(upload_id)
+    open(data_path, "wb").close()
+    with open(info_path, "w") as f:
+        json.dump({"stuid": stuid, "filename": filename, "size": size,
+                   "started": time.time()}, f)
+    return upload_id
+
+def load_upload(stuid, upload_id):
+    """Returns the description of the user's upload, and how much of it has been received"""
+    data_path, info_path = upload_paths(upload_id)
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except (IOError, ValueError):
+        raise NotFound("There is no such upload. It may have expired, so please start again.")
+    if info["stuid"] != stuid:
+        raise Forbidden("This upload belongs to someone else.")
+    return info, os.path.getsize(data_path)
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def continue_upload(stuid, upload_id, offset, stream):
+    """
+    Appends the bytes in stream to an upload, which must start where the
+    upload has got to. Returns the new offset, and the URL of the file
+    once all of it has arrived.
+
+    The data file is locked while it is written, so that a request retried
+    while the first one is still running waits for it, and then finds
+    that the offset has moved on.
+    """
+    info, received = load_upload(stuid, upload_id)
+    data_path, info_path = upload_paths(upload_id)
+    with open(data_path, "ab") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        # the upload may have moved on, or finished, while we waited for the lock
+        if not os.path.exists(info_path):
+            raise NotFound("This upload has already finished.")
+        received = os.fstat(f.fileno()).st_size
+        if offset != received:
+            error = Conflict("This upload has received %d bytes, so continue from there." % received)
+            error.offset = received
+            raise error
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+            if received > info["size"]:
+                raise RequestEntityTooLarge("This is more than the %d bytes that were started." %
+                                            info["size"])
+            f.write(chunk)
+        f.flush()
+        if received < info["size"]:
+            return received, None
+        url = store(data_path, hash_file(data_path), extension(info["filename"]))
+        os.remove(info_path)
+    return received, url
+
+def clean_incoming(max_age):
+    """Removes unfinished uploads older than max_age seconds; returns how many"""
+    path = incoming_dir()
+    removed = 0
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if time.time() - os.path.getmtime(full) > max_age:
+            os.remove(full)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "clean"
+    if command == "clean":
+        print "Removed %d unfinished uploads." % clean_incoming(options.upload_expiry_hours * 3600)
+    else:
+        print "The command is: python uploads.py (clean)"
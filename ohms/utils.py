@@ -1,4 +1,6 @@
 import json
+import csv
+import zlib
 from datetime import datetime
 from objects import QuestionResponse, ItemResponse
 
@@ -27,3 +29,38 @@ def convert_to_last_name(name):
         return x[-1] + ', ' + " ".join(x[:-1])
     else:
         return " ".join(x[-2:]) + ',' + " ".join(x[:-2])
+
+class LineWriter(object):
+    """File-like object that hands each line written to it back to the caller"""
+    def write(self, line):
+        return line
+
+def encode_cell(value):
+    if value is None:
+        return ""
+    elif isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+def csv_lines(rows, **kwargs):
+    """Generates the lines of a CSV file, one row at a time"""
+    writer = csv.writer(LineWriter(), lineterminator="\n", **kwargs)
+    for row in rows:
+        yield writer.writerow([encode_cell(value) for value in row])
+
+def gzip_chunks(chunks):
+    """Compresses a stream of strings into a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def percentile(values, p):
+    """Returns the p-th percentile of a list of numbers, by nearest rank"""
+    values = sorted(values)
+    if not values:
+        return None
+    k = int(round(p / 100. * (len(values) - 1)))
+    return values[k]
@@ -0,0 +1,251 @@
+"""
+wsgi.py
+
+A persistent, pre-forked server for OHMS.
+
+cgi-bin/index.cgi starts a new Python process for every request, which
+imports everything and creates a new database engine each time. This
+server imports the app once, then forks `server_workers` processes that
+each serve requests on the shared listening socket, keeping their imports,
+caches and database connections between requests. Configure it in
+options.py.
+
+    python wsgi.py                 # run the server
+    python wsgi.py bench [n] [path ...]
+                                   # compare request latency with index.cgi
+
+Signals sent to the master process:
+
+    HUP       graceful reload: workers finish their current request and
+              exit, and the master re-executes itself with the new code
+              on the same socket
+    TERM/INT  graceful shutdown
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import socket
+import traceback
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+import options
+
+LISTEN_FD = "OHMS_SERVER_FD"
+
+
+def load_app():
+    from app import app
+    return ProxyAuth(app) if options.server_proxy_auth else app
+
+
+class ProxyAuth(object):
+    """
+    Takes the user from headers set by the authenticating proxy in front
+    of the server, in place of the WEBAUTH_* variables that CGI provides.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        environ["WEBAUTH_USER"] = environ.get("HTTP_X_WEBAUTH_USER")
+        environ["WEBAUTH_LDAP_DISPLAYNAME"] = environ.get("HTTP_X_WEBAUTH_LDAP_DISPLAYNAME")
+        return self.app(environ, start_response)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PreforkServer(WSGIServer):
+    """A WSGIServer that counts the requests it has handled"""
+    handled = 0
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        WSGIServer.process_request(self, request, client_address)
+
+
+def make_server():
+    """Returns a WSGIServer on the configured port, or on the socket inherited from a reload"""
+    server = PreforkServer((options.server_host, options.server_port), QuietHandler,
+                           bind_and_activate=False)
+    if LISTEN_FD in os.environ:
+        server.socket = socket.fromfd(int(os.environ.pop(LISTEN_FD)),
+                                      socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        server.server_bind()
+        server.server_activate()
+    host, port = server.socket.getsockname()[:2]
+    server.server_name = socket.getfqdn(host)
+    server.server_port = port
+    server.setup_environ()
+    # workers poll the socket, so that they notice when they are told to stop
+    server.socket.setblocking(0)
+    server.timeout = 1
+    return server
+
+
+class Master(object):
+
+    def __init__(self, server, app):
+        self.server = server
+        self.app = app
+        self.workers = set()
+        self.running = True
+        self.reloading = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        try:
+            run_worker(self.server, self.app)
+        except:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def stop_workers(self):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def handle_stop(self, signum, frame):
+        self.running = False
+
+    def handle_reload(self, signum, frame):
+        self.running = False
+        self.reloading = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        for _ in range(options.server_workers):
+            self.spawn()
+
+        while self.running:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            # workers from before a reload are children too, but not ours to replace
+            if pid in self.workers:
+                self.workers.remove(pid)
+                if self.running:
+                    self.spawn()
+
+        self.stop_workers()
+        if self.reloading:
+            # the old workers finish in-flight requests while the new code loads;
+            # they stay children of this process, since exec keeps the pid
+            os.environ[LISTEN_FD] = str(self.server.socket.fileno())
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        while True:
+            try:
+                os.wait()
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    break
+                if e.errno != errno.EINTR:
+                    raise
+
+
+def run_worker(server, app):
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if app is None:
+        app = load_app()
+    # connections must not be shared with the master or other workers
+    from base import engine
+    engine.dispose()
+    server.set_app(app)
+
+    while not stopping and server.handled < options.server_max_requests:
+        server.handle_request()
+
+def serve():
+    server = make_server()
+    app = load_app() if options.server_preload else None
+    print "Serving OHMS on http://%s:%d with %d workers (pid %d)" % (
+        options.server_host, server.server_port, options.server_workers, os.getpid())
+    sys.stdout.flush()
+    Master(server, app).run()
+
+
+def time_cgi(path, n):
+    """Times n requests to cgi-bin/index.cgi, each in a new process as in production"""
+    import subprocess
+    cgi_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cgi-bin")
+    path_info, _, query = path.partition("?")
+    env = dict(os.environ, REQUEST_METHOD="GET", PATH_INFO=path_info, QUERY_STRING=query,
+               SERVER_NAME="localhost", SERVER_PORT="80", SERVER_PROTOCOL="HTTP/1.0",
+               SCRIPT_NAME="/cgi-bin/index.cgi")
+    times = []
+    for _ in range(n):
+        start = time.time()
+        p = subprocess.Popen([sys.executable, "index.cgi"], cwd=cgi_dir, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p.communicate()
+        times.append(time.time() - start)
+    return times
+
+def time_server(url, n):
+    import urllib2
+    times = []
+    for _ in range(n):
+        start = time.time()
+        urllib2.urlopen(url).read()
+        times.append(time.time() - start)
+    return times
+
+def bench(n, paths):
+    """Starts the server, and times the same requests against it and against index.cgi"""
+    import subprocess
+    from utils import percentile
+    base_url = "http://%s:%d" % (options.server_host, options.server_port)
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__)])
+    try:
+        import urllib2
+        for _ in range(100):
+            try:
+                urllib2.urlopen(base_url + "/").read()
+                break
+            except IOError:
+                time.sleep(0.1)
+        print "%-30s %-8s %9s %9s %9s" % ("path", "mode", "mean ms", "p50 ms", "p95 ms")
+        for path in paths:
+            for mode, times in [("cgi", time_cgi(path, n)),
+                                ("server", time_server(base_url + path, n))]:
+                print "%-30s %-8s %9.1f %9.1f %9.1f" % (
+                    path, mode, 1000 * sum(times) / len(times),
+                    1000 * percentile(times, 50), 1000 * percentile(times, 95))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command == "serve":
+        serve()
+    elif command == "bench":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+        bench(n, sys.argv[3:] or ["/", "/list", "/grades"])
+    else:
+        print "The command is: python wsgi.py (serve/bench [n] [path ...])"
@@ -0,0 +1,127 @@
+"""
+xml_export.py
+
+Exports homeworks as XML, without the ids of their questions and items,
+so that they can be imported again as new questions (see xml_import.py).
+
+The XML is streamed one question at a time from the stored XML of each
+question, with the ids taken out of its tags, rather than building the
+whole document in memory. A whole course, or any set of homeworks, can be
+exported as a .tar.gz archive with one file per homework, for the next
+term:
+
+    python xml_export.py [course.tar.gz]
+
+and after unpacking it, imported with `python xml_import.py DIRECTORY`.
+"""
+
+import re
+import sys
+import time
+import tarfile
+import StringIO
+from xml.sax.saxutils import quoteattr
+
+from base import session
+from objects import Homework, Question
+
+TAG = re.compile(r"<[^>]+>")
+# review_of is added again for archives (see homework_xml)
+ID = re.compile(r'\s+(?:id|review_of)="[^"]*"')
+REVIEWED_ID = re.compile(r'\squestion_id="(\d+)"')
+
+def strip_ids(xml):
+    """
+    Removes the id attributes from XML written by ElementTree, which always
+    escapes quotes and angle brackets in attribute values, so an id can only
+    be matched inside a tag, as an attribute.
+    """
+    return TAG.sub(lambda tag: ID.sub("", tag.group(0)), xml)
+
+def review_of(xml):
+    """
+    Returns a peer review's reviewed question as "<homework name>#<n>", for
+    the nth question of that homework, which stays the same in a new term
+    where the question has a different id.
+    """
+    match = REVIEWED_ID.search(xml)
+    question = session.query(Question).get(int(match.group(1))) if match else None
+    if question is None or question.homework is None:
+        return None
+    ids = [q_id for q_id, in session.query(Question.id).
+           filter(Question.hw_id == question.hw_id).order_by(Question.id)]
+    return "%s#%d" % (question.homework.name, ids.index(question.id) + 1)
+
+def homework_xml(hw, attributes=False):
+    """
+    Generates the XML of a homework, one question at a time. With
+    `attributes`, for an archive, the <homework> element also has the
+    homework's name and category, and peer reviews name the question they
+    review by review_of (see above), all of which xml_import.py reads.
+    """
+    if attributes:
+        yield "<homework name=%s%s>\n" % (
+            quoteattr(hw.name.encode("utf-8")),
+            " category=%s" % quoteattr(hw.category.name.encode("utf-8")) if hw.category else "")
+    else:
+        yield "<homework>\n"
+    questions = session.query(Question.xml, Question.type).filter(Question.hw_id == hw.id).\
+        order_by(Question.id).yield_per(100)
+    for i, (xml, type) in enumerate(questions):
+        xml = strip_ids(xml)
+        if attributes and type == "Peer Review":
+            reviewed = review_of(xml)
+            if reviewed is not None:
+                xml = xml.replace("<question", "<question review_of=%s" % quoteattr(reviewed), 1)
+        yield ("\n\n" if i else "") + xml.encode("utf-8")
+    yield "\n</homework>"
+
+
+class ChunkWriter(object):
+    """File-like object that keeps what is written to it until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def take(self):
+        data = "".join(self.chunks)
+        self.chunks = []
+        return data
+
+def archive_name(hw):
+    return re.sub(r"[^\w.-]+", "_", hw.name).strip("_") + ".xml"
+
+def course_archive(homeworks):
+    """
+    Generates a .tar.gz archive with the XML of each homework, as
+    <name>.xml. Each homework is held in memory while it is added, since
+    a tar file records the size of each file before its contents.
+    """
+    writer = ChunkWriter()
+    archive = tarfile.open(fileobj=writer, mode="w|gz")
+    names = set()
+    for hw in homeworks:
+        data = "".join(homework_xml(hw, attributes=True))
+        name = archive_name(hw)
+        while name in names:
+            name = "_" + name
+        names.add(name)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        archive.addfile(info, StringIO.StringIO(data))
+        yield writer.take()
+    archive.close()
+    yield writer.take()
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "course.tar.gz"
+    homeworks = session.query(Homework).order_by(Homework.due_date).all()
+    with open(path, "wb") as f:
+        for chunk in course_archive(homeworks):
+            f.write(chunk)
+    print "Exported %d homeworks to %s." % (len(homeworks), path)
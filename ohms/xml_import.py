@@ -0,0 +1,301 @@
+"""
+xml_import.py
+
+Imports homework XML in a single transaction.
+
+The XML is parsed incrementally, and every question and item in it is
+checked before anything is written, so that an invalid file changes
+nothing. New questions and items are written with one INSERT per table,
+rather than through the ORM, and their ids are assigned by the database,
+so that questions added at the same time elsewhere cannot take the same
+ids. The ids are read back with one query per table, and the XML of the
+new questions, which contains them, is then written with one UPDATE.
+Questions that already
+have an id (edited copies of exported XML with ids left in) are updated in
+place, in the same transaction.
+
+To import a directory of homework banks, one homework per file, parsing
+the files in parallel:
+
+    python xml_import.py DIRECTORY [category]
+
+Each homework is named after its file, unless its <homework> element has
+a name attribute, and is put in the given category, or else the one named
+by its category attribute if that exists (as in archives from
+xml_export.py). Nothing is imported if any file is invalid.
+"""
+
+import os
+import re
+import sys
+import binascii
+import StringIO
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from sqlalchemy import bindparam
+
+from base import session
+from grading import mark_homeworks_dirty
+from objects import Homework, Question, PeerReview, Item, MultipleChoiceItem, \
+    ShortAnswerItem, LongAnswerItem, Category, strip_and_save_tail
+
+ITEM_CLASSES = {'Multiple Choice': MultipleChoiceItem,
+                'Long Answer': LongAnswerItem,
+                'Short Answer': ShortAnswerItem}
+
+# stand-ins for ids in the stored XML, until the ids are allocated
+QUESTION_ID = "__question_id__"
+ITEM_ID = "__item_id_%d__"
+# the XML of new questions until then, to find their rows
+IMPORT_MARKER = "__import_%s_"
+
+REVIEWED_ID = re.compile(r'(\squestion_id=")[^"]*(")')
+
+
+def parse_item(node):
+    """Returns the columns of a new item, parsed exactly as Item.from_xml does"""
+    if node.attrib.get('type') not in ITEM_CLASSES:
+        raise ValueError('type of item not recognized, options are %s' % ", ".join(ITEM_CLASSES))
+    item = ITEM_CLASSES[node.attrib['type']]()
+    item.sync_from_node(node)
+    if item.type == "Short Answer" and not item.answers:
+        raise ValueError("a Short Answer item needs at least one <answer>")
+    return {"type": item.type,
+            "points": item.points,
+            "solution": item.solution,
+            "xml": ET.tostring(node, method="xml")}
+
+def parse_question(node):
+    """
+    Returns the columns of a question and its items, with stand-ins for
+    their ids, parsed as Question.sync_from_node would. Raises an exception
+    if the question is not valid.
+    """
+    node.tail = None
+    if 'id' in node.attrib:
+        # updated by the ORM when it is imported, but checked now
+        for e in node.iter('item'):
+            parse_item(e)
+        return {"id": int(node.attrib['id']),
+                "xml": ET.tostring(node, method="xml")}
+
+    if 'review' in node.attrib and 't' in node.attrib['review'].lower():
+        question = PeerReview()
+        question.sync_from_node(node)
+        return {"id": None,
+                "type": question.type,
+                "name": None,
+                "points": question.points,
+                "xml": question.xml,
+                "reviews": question.question_id,
+                "review_of": node.attrib.get("review_of"),
+                "items": []}
+
+    node.attrib['id'] = QUESTION_ID
+    items = []
+    for e in node.iter('item'):
+        if 'id' in e.attrib:
+            raise ValueError("an item has an id, but its question does not")
+        tail = strip_and_save_tail(e)
+        items.append(parse_item(e))
+        e.attrib['id'] = ITEM_ID % (len(items) - 1)
+        e.tail = tail
+    return {"id": None,
+            "type": "question",
+            "name": node.attrib['name'] if 'name' in node.attrib else "",
+            "points": sum(float(item["points"]) for item in items),
+            "xml": ET.tostring(node, method="xml"),
+            "items": items}
+
+def parse_homework(source):
+    """
+    Parses a homework from a file name, a file object or a string of XML,
+    one question at a time. Returns the attributes of the root element and
+    the parsed questions, or raises an exception listing every question
+    that is not valid.
+    """
+    if isinstance(source, unicode):
+        source = source.encode("utf-8")
+    if isinstance(source, str) and source.lstrip().startswith("<"):
+        source = StringIO.StringIO(source)
+
+    root = None
+    questions, errors = [], []
+    for event, node in ET.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = node
+        if event != "end" or node.tag != "question":
+            continue
+        try:
+            questions.append(parse_question(node))
+        except Exception as e:
+            errors.append("Question %d (%s): %s" % (len(questions) + len(errors) + 1,
+                                                    node.attrib.get("name", "no name"), e))
+        # the question has been serialized, so free its tree
+        node.clear()
+    if errors:
+        raise Exception("Invalid XML:\n" + "\n".join(errors))
+    return dict(root.attrib), questions
+
+def parse_file(path):
+    """Parses one file in a worker process; returns (path, (attributes, questions) or the error)"""
+    try:
+        return path, parse_homework(path)
+    except Exception as e:
+        return path, "%s: %s" % (e.__class__.__name__, e)
+
+
+def check_references(questions):
+    """Checks that the questions being updated, and the questions being reviewed, exist"""
+    ids = set(q["id"] for q in questions if q["id"] is not None)
+    # peer reviews from an archive are checked by resolve_reviews
+    reviewed = set(q["reviews"] for q in questions
+                   if q.get("reviews") is not None and not q.get("review_of"))
+    found = set(q_id for q_id, in session.query(Question.id).
+                filter(Question.id.in_(ids | reviewed))) if ids or reviewed else set()
+    errors = ["Question %d does not exist." % q_id for q_id in sorted(ids - found)] + \
+        ["The question reviewed, %d, does not exist." % q_id for q_id in sorted(reviewed - found)]
+    if errors:
+        raise Exception("\n".join(errors))
+
+def write_questions(hw, questions):
+    """Adds the parsed questions to hw, without committing"""
+    questions_table, items_table = Question.__table__, Item.__table__
+    new = [q for q in questions if q["id"] is None]
+
+    # the new questions are inserted in one statement, each with a marker
+    # for XML, by which their ids are read back in one query
+    token = IMPORT_MARKER % binascii.hexlify(os.urandom(8))
+    if new:
+        session.execute(questions_table.insert(), [
+            {"hw_id": hw.id, "type": q["type"], "name": q["name"],
+             "points": q["points"], "xml": "%s%d" % (token, i)} for i, q in enumerate(new)])
+        for question_id, marker in session.query(Question.id, Question.xml).\
+                filter(Question.hw_id == hw.id).filter(Question.xml.like(token + "%")):
+            if marker.startswith(token):
+                new[int(marker[len(token):])]["new_id"] = question_id
+
+    # no one else can add items to questions that have not been committed,
+    # so their items' ids, in order, are those of the rows inserted here
+    item_rows = [dict(item, question_id=q["new_id"]) for q in new for item in q["items"]]
+    item_ids = defaultdict(list)
+    if item_rows:
+        session.execute(items_table.insert(), item_rows)
+        for item_id, question_id in session.query(Item.id, Item.question_id).\
+                filter(Item.question_id.in_([q["new_id"] for q in new if q["items"]])).\
+                order_by(Item.id):
+            item_ids[question_id].append(item_id)
+
+    xml_rows = []
+    for q in new:
+        xml = q["xml"].replace(QUESTION_ID, str(q["new_id"]))
+        for i, item_id in enumerate(item_ids[q["new_id"]]):
+            xml = xml.replace(ITEM_ID % i, str(item_id))
+        xml_rows.append({"question_id": q["new_id"], "new_xml": xml})
+    if xml_rows:
+        session.execute(questions_table.update().
+                        where(questions_table.c.id == bindparam("question_id")).
+                        values(xml=bindparam("new_xml")), xml_rows)
+
+    # questions that already exist are updated, and moved to this homework
+    for q in questions:
+        if q["id"] is not None:
+            question = session.query(Question).get(q["id"])
+            question.sync_from_node(ET.fromstring(q["xml"]))
+            question.hw_id = hw.id
+    session.flush()
+    return len(new), len(item_rows)
+
+def resolve_reviews(homeworks):
+    """
+    Points the peer reviews exported in an archive (see xml_export.py) at
+    the question they review, which they name by its homework and position
+    as review_of="<homework name>#<n>", since its id is different here.
+    Takes (homework, parsed questions) pairs that have been written.
+    """
+    for hw, questions in homeworks:
+        for q in questions:
+            if not q.get("review_of"):
+                continue
+            name, _, position = q["review_of"].rpartition("#")
+            ids = [q_id for q_id, in session.query(Question.id).join(Homework).
+                   filter(Homework.name == name).order_by(Question.id)]
+            if not position.isdigit() or not 0 < int(position) <= len(ids):
+                raise Exception("The question reviewed, %s, does not exist." % q["review_of"])
+            xml = REVIEWED_ID.sub(r"\g<1>%d\g<2>" % ids[int(position) - 1], q["xml"], 1)
+            session.execute(Question.__table__.update().
+                            where(Question.id == q["new_id"]).values(xml=xml))
+
+def import_questions(hw, questions):
+    """Adds the parsed questions to hw in one transaction; returns (questions, items) added"""
+    try:
+        check_references(questions)
+        counts = write_questions(hw, questions)
+        resolve_reviews([(hw, questions)])
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    # the homework's questions were loaded before the new ones were written
+    session.expire(hw, ["questions"])
+    return counts
+
+def import_homework(hw, xml):
+    """Adds the questions in a string or file of homework XML to hw"""
+    attributes, questions = parse_homework(xml)
+    return import_questions(hw, questions)
+
+def import_directory(path, category_name=None, processes=None):
+    """
+    Imports each XML file in the directory as a new homework, parsing
+    them in parallel, and writing them all in one transaction. Returns
+    (homework, questions, items) for each file.
+    """
+    from multiprocessing import Pool
+    paths = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".xml"))
+    pool = Pool(processes)
+    try:
+        parsed = pool.map(parse_file, paths)
+    finally:
+        pool.close()
+        pool.join()
+    errors = ["%s: %s" % (p, result) for p, result in parsed if isinstance(result, basestring)]
+    if errors:
+        raise Exception("Nothing was imported.\n" + "\n".join(errors))
+
+    categories = dict((c.name, c) for c in session.query(Category))
+    if category_name is not None and category_name not in categories:
+        raise Exception("There is no category named %s." % category_name)
+    names = [attributes.get("name") or os.path.splitext(os.path.basename(p))[0]
+             for p, (attributes, questions) in parsed]
+    existing = [name for name, in session.query(Homework.name).filter(Homework.name.in_(names))]
+    if existing or len(set(names)) < len(names):
+        raise Exception("These homeworks already exist: %s" %
+                        ", ".join(sorted(set(existing) | set(n for n in names if names.count(n) > 1))))
+
+    imported = []
+    try:
+        for name, (p, (attributes, questions)) in zip(names, parsed):
+            category = categories.get(category_name or attributes.get("category"))
+            hw = Homework(name=name, category=category)
+            session.add(hw)
+            session.flush()
+            check_references(questions)
+            imported.append((hw, ) + write_questions(hw, questions))
+        resolve_reviews([(hw, questions) for (hw, _, _), (p, (attributes, questions))
+                         in zip(imported, parsed)])
+        mark_homeworks_dirty([hw.id for hw, _, _ in imported])
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    return imported
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "The command is: python xml_import.py DIRECTORY [category]"
+        sys.exit(1)
+    for hw, questions, items in import_directory(sys.argv[1], *sys.argv[2:3]):
+        print "%s: %d questions, %d items" % (hw.name, questions, items)
@@ -16,3 +16,68 @@ def get_db():
 # specify the IDs of the course administrators (e.g., instructors, TAs)
 admins = ['test']
 
+
+# number of rendered questions to keep in memory
+render_cache_size = 500
+
+# number of compiled answer keys to keep in memory
+grader_cache_size = 2000
+
+# outgoing mail server; e-mails are queued and sent by send_email.py
+smtp_host = "localhost"
+smtp_port = 1025
+# number of SMTP connections the worker keeps open
+smtp_connections = 2
+# e-mails sent per batch, and at most this many per minute
+email_batch_size = 50
+email_rate_limit = 200
+# failed e-mails are retried this many times, waiting longer each time
+email_max_attempts = 5
+
+# persistent server (python wsgi.py), an alternative to cgi-bin/index.cgi
+server_host = "127.0.0.1"
+server_port = 8000
+server_workers = 2
+# each worker is replaced after this many requests
+server_max_requests = 1000
+# import the app once before forking, so workers start warm
+server_preload = True
+# trust X-WebAuth-User and X-WebAuth-Ldap-DisplayName headers from the proxy in front
+server_proxy_auth = False
+
+# python startup.py fails if importing the app and serving one page takes longer (for CGI)
+startup_budget_ms = 1000
+
+# database connection pool (not used with SQLite): connections kept open per process,
+# extra connections allowed under load, seconds before a connection is replaced,
+# and whether to check that a connection is alive before using it
+db_pool_size = 5
+db_max_overflow = 10
+db_pool_recycle = 3600
+db_pool_pre_ping = True
+
+# compiled templates are cached here and shared by every process (python precompile.py fills it);
+# set to None to turn the cache off
+template_cache_dir = ".jinja_cache"
+
+# set to a long random string to remember who is logged in, in a signed cookie,
+# for this many seconds, so that most requests skip looking up the user
+identity_token_secret = None
+identity_token_ttl = 300
+
+# time the SQL queries and templates of every request, report them in a Server-Timing
+# header, and list the last profile_buffer_size requests on the admin page
+profile_requests = False
+profile_buffer_size = 200
+
+# the listing of WWW/restricted/ for the materials page is kept here, shared by every
+# process, until the directory changes; set to None to keep it in memory only
+materials_cache_file = ".materials.json"
+
+# uploaded files (attached to answers) may be at most this many bytes, with one of
+# these extensions; unfinished uploads are removed by "python uploads.py clean"
+# after upload_expiry_hours
+upload_max_size = 20 * 1024 * 1024
+upload_extensions = ["jpg", "jpeg", "png", "gif", "pdf", "txt", "doc", "docx",
+                     "xls", "xlsx", "csv", "r", "py", "zip"]
+upload_expiry_hours = 24
@@ -1,3 +1,5 @@
+import os
+
 target = "prod"
 
 # this customizes the page header
@@ -22,8 +24,10 @@ htaccess = ""
 # htaccess = "%s/WWW/restricted/.htaccess" % base_dir
 
 # grab the username, password, and database name from db_info file (this works as of Autumn 2014)
-def get_db():
-    f = open("%s/db_private/db_info" % base_dir, "r")
+db_info_file = "%s/db_private/db_info" % base_dir
+
+def read_db_info():
+    f = open(db_info_file, "r")
     info = f.read().strip().split('\n')
     username = info[0].split(': ')[1]
     password = info[1].split(': ')[1]
@@ -32,5 +36,93 @@ def get_db():
     # NB. The alternative is to simply hard code this URL into this file
     return "mysql://%s:%s@%s/%s?charset=utf8" % (username, password, server, db_name)
 
+# the URL is cached next to this file (inside ohms/, which only the CGI user can read),
+# so that starting a CGI process does not read db_private; the cache is rebuilt
+# whenever db_info is newer than it
+db_url_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".db_url")
+
+def get_db():
+    try:
+        if os.path.getmtime(db_url_cache) >= os.path.getmtime(db_info_file):
+            with open(db_url_cache) as f:
+                return f.read().strip()
+    except (IOError, OSError):
+        pass
+    url = read_db_info()
+    try:
+        # replace the old cache in one step, so a concurrent reader never sees it half written
+        tmp = "%s.%d" % (db_url_cache, os.getpid())
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), "w") as f:
+            f.write(url)
+        os.rename(tmp, db_url_cache)
+    except (IOError, OSError):
+        pass
+    return url
+
 # specify the IDs of the course administrators (e.g., instructors, TAs)
 admins = ['dlsun', 'naftali']
+
+# number of rendered questions to keep in memory
+render_cache_size = 500
+
+# number of compiled answer keys to keep in memory
+grader_cache_size = 2000
+
+# outgoing mail server; e-mails are queued and sent by send_email.py
+smtp_host = "localhost"
+smtp_port = 25
+# number of SMTP connections the worker keeps open
+smtp_connections = 2
+# e-mails sent per batch, and at most this many per minute
+email_batch_size = 50
+email_rate_limit = 200
+# failed e-mails are retried this many times, waiting longer each time
+email_max_attempts = 5
+
+# persistent server (python wsgi.py), an alternative to cgi-bin/index.cgi
+server_host = "127.0.0.1"
+server_port = 8080
+server_workers = 4
+# each worker is replaced after this many requests
+server_max_requests = 1000
+# import the app once before forking, so workers start warm
+server_preload = True
+# trust X-WebAuth-User and X-WebAuth-Ldap-DisplayName headers from the proxy in front
+server_proxy_auth = True
+
+# python startup.py fails if importing the app and serving one page takes longer (for CGI)
+startup_budget_ms = 1000
+
+# database connection pool (not used with SQLite): connections kept open per process,
+# extra connections allowed under load, seconds before a connection is replaced,
+# and whether to check that a connection is alive before using it
+db_pool_size = 5
+db_max_overflow = 10
+db_pool_recycle = 3600
+db_pool_pre_ping = True
+
+# compiled templates are cached here and shared by every process (python precompile.py fills it);
+# set to None to turn the cache off
+template_cache_dir = "%s/ohms/.jinja_cache" % base_dir
+
+# set to a long random string to remember who is logged in, in a signed cookie,
+# for this many seconds, so that most requests skip looking up the user
+identity_token_secret = None
+identity_token_ttl = 300
+
+# time the SQL queries and templates of every request, report them in a Server-Timing
+# header, and list the last profile_buffer_size requests on the admin page
+profile_requests = False
+profile_buffer_size = 200
+
+# the listing of WWW/restricted/ for the materials page is kept here, shared by every
+# process, until the directory changes; set to None to keep it in memory only
+materials_cache_file = "%s/ohms/.materials.json" % base_dir
+
+# uploaded files (attached to answers) may be at most this many bytes, with one of
+# these extensions; unfinished uploads are removed by "python uploads.py clean"
+# after upload_expiry_hours
+upload_max_size = 20 * 1024 * 1024
+upload_extensions = ["jpg", "jpeg", "png", "gif", "pdf", "txt", "doc", "docx",
+                     "xls", "xlsx", "csv", "r", "py", "zip"]
+upload_expiry_hours = 24
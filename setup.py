@@ -48,3 +48,11 @@ from ohms.objects import Base
 from ohms.base import engine
 Base.metadata.create_all(engine)
 
+# bring an existing database up to the latest schema version
+from ohms.migrations import upgrade
+for version, description in upgrade():
+    print "Applied migration %d: %s" % (version, description)
+
+
+# compile the templates into the shared template cache
+run_command("cd %s/ohms && python precompile.py" % root)
@@ -31,6 +31,28 @@ var OHMS = (function(OHMS) {
 	    var question = new OHMS.Question(this,questions.eq(i));
 	    this.questions.push(question);
 	}
+	this.load_responses();
+    }
+
+    Homework.prototype.load_responses = function () {
+	// fetch the responses to all of the questions in one request
+	var that = this;
+	$.ajax({
+	    url : "load_hw?hw_id=" + this.id,
+	    type : "GET",
+	    dataType : "json",
+	    success : function (data) {
+		for (var i=0; i<that.questions.length; i++) {
+		    var question = that.questions[i];
+		    if (data[question.id])
+			question.load_response_success(data[question.id]);
+		}
+	    },
+	    error : function (xhr) {
+		if (that.questions.length)
+		    that.questions[0].load_response_error(xhr);
+	    }
+	});
     }
 
     Homework.prototype.update_name = function(name) {
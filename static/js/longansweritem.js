@@ -14,8 +14,12 @@ var OHMS = (function(OHMS) {
 	this.textarea = this.element.find("textarea");
 	this.preview = this.element.find(".response");
 	this.id = this.textarea.attr("id");
+	this.file_input = this.element.find("form input[type=file]");
 
 	var that = this;
+	this.file_input.change(function() {
+	    that.upload_file(this);
+	});
 	tinymce.init({
 	    selector: "textarea#" + this.id,
 	    theme: "modern",
@@ -29,7 +33,8 @@ var OHMS = (function(OHMS) {
 	    paste_as_text: true,
 	    file_picker_callback: function(callback, value, meta) {
 		if (meta.filetype == 'file' || meta.filetype == 'image') {
-		    $("form#" + that.id + " input").click();
+		    that.file_picked = callback;
+		    that.file_input.click();
 		    $(".mce-btn.mce-open").parent().find(".mce-textbox").val("upload in progress...");
 		} else 
 		    alert("File upload not supported for this type.");
@@ -54,6 +59,31 @@ var OHMS = (function(OHMS) {
     }
     
     LongAnswerItem.prototype = new OHMS.Item();
+
+    // uploads the file chosen in the file picker, and puts its URL in the picker
+    LongAnswerItem.prototype.upload_file = function (input) {
+	var textbox = $(".mce-btn.mce-open").parent().find(".mce-textbox");
+	if (!OHMS.Upload.supported() || !input.files) {
+	    $(input).parent("form").submit();
+	    input.value = '';
+	    return;
+	}
+	var callback = this.file_picked;
+	var upload = new OHMS.Upload(input.files[0],
+	    function (sent, size) {
+		textbox.val("upload in progress... " + (size ? Math.floor(100 * sent / size) : 100) + "%");
+	    },
+	    function (url) {
+		textbox.val('');
+		callback(url);
+	    },
+	    function (error) {
+		textbox.val('');
+		alert(error);
+	    });
+	upload.start();
+	input.value = '';
+    }
         
     LongAnswerItem.prototype.get_value = function () {
 	return this.editor.getContent();
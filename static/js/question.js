@@ -29,7 +29,6 @@ var OHMS = (function(OHMS) {
 		this.items.push(item);
 	    }
 
-	    this.load_response();
 	    this.bind_events();
 	}
 
@@ -74,16 +73,6 @@ var OHMS = (function(OHMS) {
 	    })
 	}
 
-	Question.prototype.load_response = function () {
-	    $.ajax({
-		    url : "load?q_id=" + this.id,
-		    type : "GET",
-		    dataType : "json",
-		    success : $.proxy(this.load_response_success,this),
-		    error : $.proxy(this.load_response_error,this),
-		});
-	}
-
 	Question.prototype.load_response_success = function (data) {
 	    if (data.submission) {
 		for (var i=0; i<this.items.length; i++) {
@@ -0,0 +1,105 @@
+/*
+ *  This Source Code Form is subject to the terms of the Mozilla Public
+ *  License, v. 2.0. If a copy of the MPL was not distributed with this
+ *  file, You can obtain one at http://mozilla.org/MPL/2.0/.
+ *
+ *  Copyright (c) 2013, OHMS Development Team
+ */
+
+/*
+ * Uploads a file in chunks, using the resumable upload protocol in
+ * ohms/uploads.py, so that a large upload that fails part way picks up
+ * where it left off instead of starting again.
+ */
+
+var OHMS = (function(OHMS) {
+
+	var CHUNK_SIZE = 1024 * 1024;
+	var MAX_RETRIES = 5;
+
+	var Upload = function (file, progress, done, fail) {
+	    this.file = file;
+	    this.progress = progress;
+	    this.done = done;
+	    this.fail = fail;
+	    this.retries = 0;
+	}
+
+	// browsers without the File API use the upload form instead
+	Upload.supported = function () {
+	    return !!(window.File && window.Blob && Blob.prototype.slice && window.XMLHttpRequest);
+	}
+
+	Upload.prototype.start = function () {
+	    $.ajax({
+		    url : "upload/start",
+		    type : "POST",
+		    dataType : "json",
+		    data : {
+			filename: this.file.name,
+			size: this.file.size,
+		    },
+		    success : $.proxy(function (data) {
+			    this.id = data.id;
+			    this.send(data.offset);
+			}, this),
+		    error : $.proxy(this.error, this),
+		});
+	}
+
+	Upload.prototype.send = function (offset) {
+	    this.progress(offset, this.file.size);
+	    $.ajax({
+		    url : "upload/" + this.id + "?offset=" + offset,
+		    type : "PUT",
+		    dataType : "json",
+		    data : this.file.slice(offset, offset + CHUNK_SIZE),
+		    processData : false,
+		    contentType : "application/octet-stream",
+		    success : $.proxy(function (data) {
+			    this.retries = 0;
+			    if (data.url)
+				this.done(data.url);
+			    else
+				this.send(data.offset);
+			}, this),
+		    error : $.proxy(this.error, this),
+		});
+	}
+
+	// asks the server how much it has, after a chunk may have been lost
+	Upload.prototype.resume = function () {
+	    $.ajax({
+		    url : "upload/" + this.id,
+		    type : "GET",
+		    dataType : "json",
+		    success : $.proxy(function (data) {
+			    this.send(data.offset);
+			}, this),
+		    error : $.proxy(this.error, this),
+		});
+	}
+
+	Upload.prototype.error = function (xhr) {
+	    var data = {};
+	    try {
+		data = $.parseJSON(xhr.responseText) || {};
+	    } catch (e) {}
+
+	    // the server has a different part of the file, so send that
+	    if (xhr.status == 409 && data.offset !== undefined) {
+		this.send(data.offset);
+	    // the connection failed, or the server did: wait, then resume
+	    } else if ((xhr.status == 0 || xhr.status >= 500) && this.id && this.retries < MAX_RETRIES) {
+		this.retries += 1;
+		setTimeout($.proxy(this.resume, this), 1000 * Math.pow(2, this.retries));
+	    } else {
+		this.fail(data.error || "The file could not be uploaded. Please try again.");
+	    }
+	}
+
+	OHMS.Upload = Upload;
+
+	return OHMS;
+
+    }(OHMS));
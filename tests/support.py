@@ -0,0 +1,27 @@
+"""
+support.py
+
+Sets up the tests: ohms/ is put on the path, and the options module is
+loaded from options/local_options.py, with the database and uploads kept
+in a temporary directory. Import this before any module from ohms/.
+"""
+
+import os
+import sys
+import imp
+import atexit
+import shutil
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, "ohms"))
+
+tmp_dir = tempfile.mkdtemp(prefix="ohms-tests-")
+atexit.register(shutil.rmtree, tmp_dir, True)
+
+options = imp.load_source("options", os.path.join(root, "options", "local_options.py"))
+options.base_dir = tmp_dir
+options.upload_dir = "uploads"
+options.get_db = lambda: "sqlite:///%s/ohms.db" % tmp_dir
+options.template_cache_dir = None
+options.materials_cache_file = None
@@ -0,0 +1,72 @@
+"""
+test_expressions.py
+
+Expressions that students type in, as the graders see them.
+"""
+
+import unittest
+
+import support
+from expressions import evaluate, ExpressionError, MAX_LENGTH
+from graders import AnswerKey
+
+
+class Answer(object):
+    """Stands in for a ShortAnswer parsed from item XML"""
+
+    def __init__(self, exact):
+        self.type = "expression"
+        self.points = 1
+        self.comment = ""
+        self.exact = exact
+
+
+def binomial_sum(n):
+    return "+".join("%d*.5^%d*.5^%d" % (c, k, n - k) for k, c in enumerate(binomial_row(n)))
+
+def binomial_row(n):
+    row = [1]
+    for k in range(n):
+        row.append(row[-1] * (n - k) // (k + 1))
+    return row
+
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_accepts(self):
+        cases = [("1+2*3", 7.), ("(1+2)*3", 9.), ("2**10", 1024.), ("-2**2", -4.),
+                 ("1/4", .25), ("--1", 1.), ("1e3", 1000.), (".5*4", 2.)]
+        for text, value in cases:
+            self.assertEqual(evaluate(text), value, text)
+
+    def test_accepts_long_sums(self):
+        # 11 terms, which once counted operators as nodes, and was refused
+        text = AnswerKey.preprocess(binomial_sum(10))
+        self.assertAlmostEqual(evaluate(text), 1.)
+
+    def test_rejects(self):
+        cases = ["__import__('os')", "x", "1 if 1 else 2", "[1]", "'1'", "abs(1)",
+                 "(1).real", "1 < 2", "lambda: 1", "1+", "(1",
+                 "10**400", "1e400", "1/0", "1%2", "2**1001", "2**-2000",
+                 "1" * (MAX_LENGTH + 1)]
+        for text in cases:
+            self.assertRaises(ExpressionError, evaluate, text)
+
+
+class TestAnswerKey(unittest.TestCase):
+
+    def test_is_correct(self):
+        key = AnswerKey(Answer("3(1/2)^2"))
+        self.assertTrue(key.is_correct("3 x .25"))
+        self.assertTrue(key.is_correct("(3)(0.5)^2"))
+        self.assertFalse(key.is_correct("3 x .5"))
+        self.assertFalse(key.is_correct(""))
+
+    def test_invalid_responses(self):
+        key = AnswerKey(Answer("1"))
+        for response in ["10^400", "1/0", "(1", "a"]:
+            self.assertRaises(Exception, key.is_correct, response)
+
+
+if __name__ == "__main__":
+    unittest.main()
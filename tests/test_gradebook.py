@@ -0,0 +1,166 @@
+"""
+test_gradebook.py
+
+The gradebook computed with array operations, against the loop over
+students and homeworks that it replaced.
+"""
+
+from __future__ import division
+import random
+import unittest
+from datetime import datetime, timedelta
+
+import support
+from base import Base, engine, session
+from objects import User, Homework, Category, Grade
+from gradebook import compute_gradebook, compute_student_grades
+from utils import convert_to_last_name
+
+
+def reference_gradebook(homeworks):
+    """The gradebook as app.py used to compute it, one student at a time"""
+
+    gradebook, max_scores = {}, {}
+
+    for user in session.query(User).all():
+        if user.type == "student":
+            gradebook[user] = {}
+
+    for homework in homeworks:
+        scores = []
+        for g in session.query(Grade).filter_by(hw_id=homework.id).all():
+            student = session.query(User).get(g.stuid)
+            if student not in gradebook:
+                continue
+            gradebook[student][homework.id] = g
+            try:
+                scores.append(float(g.score))
+            except:
+                pass
+
+        if homework.max_score is not None:
+            max_scores[homework.id] = homework.max_score
+        elif scores:
+            max_scores[homework.id] = max(scores)
+        else:
+            max_scores[homework.id] = None
+
+    gradebook = gradebook.items()
+    gradebook.sort(key=lambda entry: convert_to_last_name(entry[0].name))
+
+    categories = session.query(Category).all()
+
+    for student, grades in gradebook:
+        earned = dict((c, []) for c in categories)
+        possible = dict((c, []) for c in categories)
+        for hw in homeworks:
+            if max_scores[hw.id] is None or max_scores[hw.id] == 0:
+                continue
+            possible[hw.category].append(max_scores[hw.id])
+            if hw.id in grades:
+                if grades[hw.id].excused:
+                    possible[hw.category].remove(max_scores[hw.id])
+                else:
+                    try:
+                        earned[hw.category].append(float(grades[hw.id].score))
+                    except:
+                        earned[hw.category].append(0)
+            else:
+                earned[hw.category].append(0)
+
+        grades["overall"] = 0.
+        for category, poss in possible.iteritems():
+            if len(poss) == 0:
+                grades[category.name] = "0 / 0"
+                continue
+            e, p = sum(earned[category]), sum(poss)
+            if len(poss) > category.drops + 1:
+                grades_sorted = sorted(zip(earned[category], poss), key=lambda x: -(e-x[0])/(p-x[1]))
+                grades_sorted = grades_sorted[category.drops:]
+                out = zip(*grades_sorted)
+            else:
+                out = earned[category], poss
+            grades[category.name] = "%0.1f / %0.1f" % (sum(out[0]), sum(out[1]))
+            if sum(out[1]) > 0:
+                grades["overall"] += category.weight * sum(out[0]) / sum(out[1])
+
+    return gradebook, max_scores
+
+
+class TestGradebook(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(engine)
+        rng = random.Random(60)
+        categories = [Category(name="Homework", weight=60, drops=2),
+                      Category(name="Quiz", weight=40, drops=0),
+                      Category(name="Extra", weight=0, drops=1)]
+        session.add_all(categories)
+        homeworks = [Homework(name="HW %d" % k, category=categories[k % 3],
+                              due_date=datetime(2015, 1, 1) + timedelta(days=k),
+                              max_score=[None, 10, None, 0][k % 4])
+                     for k in range(15)]
+        session.add_all(homeworks)
+        users = [User(stuid="s%d" % i, name="First Last%02d" % i,
+                      type="guest" if i % 7 == 0 else "student")
+                 for i in range(40)]
+        session.add_all(users)
+        for user in users:
+            for hw in homeworks:
+                if rng.random() < 0.15:
+                    continue
+                score = rng.choice([str(rng.randint(0, 12)), "%0.1f" % rng.uniform(0, 10), "E", ""])
+                session.add(Grade(stuid=user.stuid, homework=hw, score=score,
+                                  excused=rng.random() < 0.15))
+        session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        session.remove()
+        Base.metadata.drop_all(engine)
+
+    def homeworks(self):
+        return session.query(Homework).order_by(Homework.due_date).all()
+
+    def assertSameGrades(self, expected, actual):
+        self.assertEqual(set(expected), set(actual))
+        for key in expected:
+            if key == "overall":
+                self.assertAlmostEqual(expected[key], actual[key])
+            elif isinstance(key, (int, long)):
+                self.assertEqual((expected[key].score, expected[key].excused),
+                                 (actual[key].score, actual[key].excused))
+            else:
+                self.assertEqual(expected[key], actual[key], key)
+
+    def test_matches_reference(self):
+        homeworks = self.homeworks()
+        expected, expected_max = reference_gradebook(homeworks)
+        actual, actual_max = compute_gradebook(homeworks)
+        self.assertEqual(expected_max, actual_max)
+        self.assertEqual([s.stuid for s, _ in expected], [s.stuid for s, _ in actual])
+        for (_, e), (_, a) in zip(expected, actual):
+            self.assertSameGrades(e, a)
+
+    def test_drops_and_excused(self):
+        # the data should exercise what the comparison is for
+        homeworks = self.homeworks()
+        gradebook, max_scores = compute_gradebook(homeworks)
+        counted = [hw for hw in homeworks if hw.category.name == "Homework" and max_scores[hw.id]]
+        self.assertTrue(len(counted) > 3)
+        self.assertTrue(session.query(Grade).filter_by(excused=True).count())
+
+    def test_student_grades(self):
+        # one student's grades, with the maximum scores given
+        homeworks = self.homeworks()
+        gradebook, max_scores = compute_gradebook(homeworks)
+        for hw in homeworks:
+            hw.top_score = max_scores[hw.id]
+        student, expected = gradebook[0]
+        actual, _ = compute_student_grades(student, homeworks)
+        self.assertSameGrades(expected, actual)
+
+
+if __name__ == "__main__":
+    unittest.main()
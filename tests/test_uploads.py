@@ -0,0 +1,61 @@
+"""
+test_uploads.py
+
+Resumable uploads: chunks at the wrong offset are refused, and the file
+is stored under its hash once all of it has arrived.
+"""
+
+import os
+import hashlib
+import unittest
+from StringIO import StringIO
+
+import support
+from werkzeug.exceptions import Conflict, Forbidden, NotFound, RequestEntityTooLarge
+from uploads import start_upload, load_upload, continue_upload, upload_dir, incoming_dir
+
+
+class TestUploads(unittest.TestCase):
+
+    data = "0123456789" * 10
+
+    def setUp(self):
+        self.upload_id = start_upload("student", "notes.pdf", len(self.data))
+
+    def send(self, offset, data, stuid="student"):
+        return continue_upload(stuid, self.upload_id, offset, StringIO(data))
+
+    def test_completes(self):
+        self.assertEqual(self.send(0, self.data[:40]), (40, None))
+        self.assertEqual(load_upload("student", self.upload_id)[1], 40)
+        offset, url = self.send(40, self.data[40:])
+        self.assertEqual(offset, len(self.data))
+        filename = "%s.pdf" % hashlib.sha1(self.data).hexdigest()
+        self.assertTrue(url.endswith("/" + filename))
+        with open(os.path.join(upload_dir(), filename), "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        # nothing is left behind, and the upload cannot be continued
+        self.assertFalse([name for name in os.listdir(incoming_dir()) if name.startswith(self.upload_id)])
+        self.assertRaises(NotFound, self.send, offset, "")
+
+    def test_offset_conflict(self):
+        self.send(0, self.data[:40])
+        for offset in [0, 30, 50]:
+            try:
+                self.send(offset, self.data[offset:offset + 10])
+            except Conflict as error:
+                self.assertEqual(error.offset, 40)
+            else:
+                self.fail("a chunk at offset %d was accepted" % offset)
+        # the refused chunks were not written
+        self.assertEqual(load_upload("student", self.upload_id)[1], 40)
+
+    def test_too_large(self):
+        self.assertRaises(RequestEntityTooLarge, self.send, 0, self.data + "more")
+
+    def test_someone_else(self):
+        self.assertRaises(Forbidden, self.send, 0, self.data, "other")
+
+
+if __name__ == "__main__":
+    unittest.main()